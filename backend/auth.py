@@ -1,23 +1,78 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from typing import Optional
+from typing import NamedTuple, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import event
+import asyncio
+import multiprocessing
 import os
+from cache import MemoryCacheBackend
+from models import User
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. Hashes made with a different cost are flagged for rehash on login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# bcrypt is CPU-bound, so it runs in a worker pool ("process" spreads it across cores)
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")  # "process" or "thread"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
 
 # JWT configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "rewrite-secret-key-change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Authenticated-user cache: lets a token carrying a user id skip the DB entirely
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 300))
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+_hash_executor = None
+
+def get_hash_executor():
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            # Not fork: the pool starts lazily inside a process that already runs threads
+            # (LLM gate, DB drivers), and a forked child could inherit a lock held by one of them
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context(method)
+            )
+        else:
+            _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _hash_executor
+
+def shutdown_hash_executor():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True)
+        _hash_executor = None
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), verify_and_update_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,3 +89,51 @@ def decode_access_token(token: str):
         return payload
     except JWTError:
         return None
+
+class AuthenticatedUser(NamedTuple):
+    """Immutable snapshot of the User fields endpoints need, safe to share across sessions."""
+    id: int
+    username: str
+    email: str
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, username=user.username, email=user.email)
+
+class UserCache:
+    def __init__(self, max_entries=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS):
+        self._backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        user = self._backend.get(user_id)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def put(self, user: AuthenticatedUser):
+        self._backend.set(user.id, user)
+
+    def invalidate(self, user_id):
+        self._backend.delete(user_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+user_cache = UserCache()
+
+# Invalidation hooks for ORM changes. Bulk query.update()/delete() bypass these,
+# so callers doing bulk changes to users must call user_cache.invalidate themselves.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Response cache configuration
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # "memory", "sqlite" or "none"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 6 * 3600))
+RESPONSE_CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_SQLITE_PATH", "./response_cache.db")
+# SQLite only: how long a lookup waits for another worker's write lock before counting as a miss
+RESPONSE_CACHE_SQLITE_TIMEOUT_MS = int(os.getenv("RESPONSE_CACHE_SQLITE_TIMEOUT_MS", 250))
+# SQLite only: a hit refreshes the entry's LRU position at most this often, so most hits are read-only
+RESPONSE_CACHE_TOUCH_INTERVAL_SECONDS = float(os.getenv("RESPONSE_CACHE_TOUCH_INTERVAL_SECONDS", 60))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_symptoms(text: str) -> str:
+    """Fold case, punctuation and word order so near-identical inputs share a key."""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return " ".join(sorted(text.split()))
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry expiry."""
+
+    blocking = False
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """Approximate-LRU + TTL cache stored in a SQLite table, shared by every worker on the host."""
+
+    # Calls may wait on another process's write lock, so they are run off the event loop
+    blocking = True
+
+    def __init__(self, path=RESPONSE_CACHE_SQLITE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 timeout_ms=RESPONSE_CACHE_SQLITE_TIMEOUT_MS, touch_interval=RESPONSE_CACHE_TOUCH_INTERVAL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout_ms / 1000)
+        # WAL: readers in other workers are not blocked by a writer
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_last_used ON response_cache (last_used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, last_used FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                # Expired rows are removed by the next set()
+                return None
+            if now - row[2] >= self.touch_interval:
+                self._conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Maps normalized symptom text to the raw JSON answer, counting hits and misses.
+
+    Blocking backends run in a thread. The cache is only an optimization, so a
+    backend error (e.g. "database is locked") counts as a miss, or a skipped
+    store, rather than failing the request.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def _call(self, fn, *args):
+        try:
+            if self.backend.blocking:
+                return await asyncio.to_thread(fn, *args)
+            return fn(*args)
+        except sqlite3.Error as e:
+            print(f"Response cache error: {e}")
+            self.errors += 1
+            return None
+
+    async def get(self, symptoms: str):
+        if self.backend is None:
+            return None
+        value = await self._call(self.backend.get, normalize_symptoms(symptoms))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, symptoms: str, value: str):
+        if self.backend is not None:
+            await self._call(self.backend.set, normalize_symptoms(symptoms), value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": RESPONSE_CACHE_BACKEND,
+            "entries": len(self.backend) if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one in-flight task.
+
+    The first caller starts the work; callers arriving while it runs await the
+    same task and receive its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shield so one disconnecting client does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+def build_cache_backend(name=RESPONSE_CACHE_BACKEND):
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "sqlite":
+        return SQLiteCacheBackend()
+    return None
+
+
+response_cache = ResponseCache(build_cache_backend())
+symptom_flights = SingleFlight()
@@ -0,0 +1,124 @@
+"""Streaming export of symptom history as NDJSON or CSV.
+
+Rows are read through a server-side cursor in chunks of EXPORT_CHUNK_ROWS and
+serialized straight from the materialized columns, so memory stays flat
+however large the table is. Used by the /export endpoints and from the
+command line:
+
+    python export.py --format ndjson --output history.ndjson
+    python export.py --format csv --user-id 42 > user-42.csv
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from sqlalchemy import select
+
+from models import SymptomQuery, engine, materialize_history, parse_stored_response, response_if_missing
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 1000))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CSV_HEADER = ("id", "user_id", "created_at", "symptoms", "summary", "severity_estimate", "details")
+
+
+def export_query(user_id=None):
+    query = select(
+        SymptomQuery.id,
+        SymptomQuery.user_id,
+        SymptomQuery.created_at,
+        SymptomQuery.symptoms,
+        SymptomQuery.summary,
+        SymptomQuery.severity_estimate,
+        SymptomQuery.details,
+        # The raw response is only needed for rows that have not been backfilled
+        response_if_missing(SymptomQuery.details),
+    )
+    if user_id is not None:
+        query = query.where(SymptomQuery.user_id == user_id)
+    return query.order_by(SymptomQuery.id)
+
+
+def _fields(row):
+    summary, severity, details = row.summary, row.severity_estimate, row.details
+    if details is None:
+        fields = materialize_history(parse_stored_response(row.response))
+        summary, severity, details = fields["summary"], fields["severity_estimate"], fields["details"]
+    created_at = row.created_at.isoformat() if row.created_at else None
+    return row.id, row.user_id, created_at, row.symptoms, summary, severity, details
+
+
+def ndjson_chunk(rows) -> str:
+    lines = []
+    for row in rows:
+        id_, user_id, created_at, symptoms, summary, severity, details = _fields(row)
+        # details is already compact JSON; splice its keys in rather than re-encoding
+        lines.append('{"id":%d,"user_id":%s,"created_at":%s,"symptoms":%s,"summary":%s,"severity_estimate":%s,%s}\n' % (
+            id_, json.dumps(user_id), json.dumps(created_at), json.dumps(symptoms),
+            json.dumps(summary), json.dumps(severity), details[1:-1],
+        ))
+    return "".join(lines)
+
+
+def csv_chunk(rows, header=False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows(_fields(row) for row in rows)
+    return buffer.getvalue()
+
+
+def serialize_chunk(fmt, rows, first=False) -> str:
+    if fmt == "csv":
+        return csv_chunk(rows, header=first)
+    return ndjson_chunk(rows)
+
+
+async def stream_export(session_factory, fmt, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Async generator of text chunks, one per fetched partition, for a StreamingResponse."""
+    async with session_factory() as db:
+        result = await db.stream(export_query(user_id).execution_options(yield_per=chunk_rows))
+        first = True
+        async for rows in result.partitions():
+            yield serialize_chunk(fmt, rows, first)
+            first = False
+        if first and fmt == "csv":
+            yield csv_chunk([], header=True)
+
+
+def export_to(out, fmt, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS, bind=engine):
+    """Write the export to a text file object; returns the number of rows written."""
+    total = 0
+    first = True
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(export_query(user_id))
+        for rows in result.partitions():
+            out.write(serialize_chunk(fmt, rows, first))
+            first = False
+            total += len(rows)
+    if first and fmt == "csv":
+        out.write(csv_chunk([], header=True))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--user-id", type=int, help="Export one user's history (default: all users)")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as out:
+            total = export_to(out, args.format, args.user_id, args.chunk_rows)
+    else:
+        total = export_to(sys.stdout, args.format, args.user_id, args.chunk_rows)
+    print(f"Exported {total} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter
+from resilience import LLM_DEADLINE_SECONDS
+
+# Idempotency-Key support for /check_symptoms/ (and /stream): the first request with a key runs,
+# repeats within IDEMPOTENCY_TTL_SECONDS get its stored response, and repeats that
+# arrive while it is still running wait for it. "memory" keeps keys per worker;
+# "sqlite" shares them between the workers on one host.
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")  # "memory", "sqlite" or "none"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000))
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "./idempotency.db")
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+# A key whose request died without completing (e.g. a killed worker) is released after this long
+IDEMPOTENCY_PENDING_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_TTL_SECONDS", LLM_DEADLINE_SECONDS + 15))
+IDEMPOTENCY_POLL_MS = int(os.getenv("IDEMPOTENCY_POLL_MS", 100))
+# How long a SQLite call waits on another worker's write lock before the request runs without its key
+IDEMPOTENCY_SQLITE_TIMEOUT_MS = int(os.getenv("IDEMPOTENCY_SQLITE_TIMEOUT_MS", 250))
+
+idempotent_requests_total = Counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome", ("outcome",)
+)
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was first used with a different request body."""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running elsewhere and did not finish in time."""
+
+
+def request_fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class MemoryIdempotencyStore:
+    """Keys in an in-process LRU dict: key -> (fingerprint, response body or None while pending, expires_at)."""
+
+    blocking = False
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key, fingerprint, pending_ttl):
+        """Reserve `key` for the caller and return None, or return the existing (fingerprint, body)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] >= now:
+                return entry[0], entry[1]
+            self._entries[key] = (fingerprint, None, now + pending_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return None
+
+    def get(self, key):
+        """The live (fingerprint, body) for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (entry[0], entry[1]) if entry is not None and entry[2] >= time.time() else None
+
+    def complete(self, key, body, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], body, time.time() + ttl)
+
+    def abort(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteIdempotencyStore:
+    """Keys in a SQLite table, so a retry landing on another worker still finds the first response."""
+
+    # Calls may wait on another process's write lock, so they are run off the event loop
+    blocking = True
+
+    def __init__(self, path=IDEMPOTENCY_SQLITE_PATH, max_entries=IDEMPOTENCY_MAX_ENTRIES,
+                 timeout_ms=IDEMPOTENCY_SQLITE_TIMEOUT_MS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout_ms / 1000)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, body TEXT, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires ON idempotency_keys (expires_at)")
+
+    def begin(self, key, fingerprint, pending_ttl):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so only one worker can reserve a key
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT fingerprint, body FROM idempotency_keys WHERE key = ? AND expires_at >= ?", (key, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, body, expires_at) VALUES (?, ?, NULL, ?)",
+                        (key, fingerprint, now + pending_ttl),
+                    )
+                    self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+                    self._conn.execute(
+                        "DELETE FROM idempotency_keys WHERE key IN ("
+                        "SELECT key FROM idempotency_keys ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return tuple(row) if row is not None else None
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, body FROM idempotency_keys WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+            return tuple(row) if row is not None else None
+
+    def complete(self, key, body, ttl):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency_keys SET body = ?, expires_at = ? WHERE key = ?", (body, time.time() + ttl, key)
+            )
+
+    def abort(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND body IS NULL", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+
+
+class IdempotentRequests:
+    """Runs each (user, Idempotency-Key) at most once per TTL and shares its response.
+
+    Only successful responses are stored: when the first request fails, its
+    key is released and the next retry (or a repeat that was waiting) runs
+    again. Repeats in the same worker await the first request's result
+    directly (like SingleFlight); repeats on another worker poll the shared
+    store until the first request finishes. No wait outlasts the pending TTL.
+    If the store fails, the request runs as if it carried no key.
+    """
+
+    def __init__(self, store, ttl=IDEMPOTENCY_TTL_SECONDS, pending_ttl=IDEMPOTENCY_PENDING_TTL_SECONDS,
+                 poll_ms=IDEMPOTENCY_POLL_MS):
+        self.store = store
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.poll = poll_ms / 1000
+        self.errors = 0
+        self._results = {}  # key -> future of the response body (None if it failed), while its first request runs here
+        self._tasks = set()  # first requests running detached from their connection
+
+    async def _call(self, fn, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _error(self, e):
+        print(f"Idempotency store error: {e}")
+        self.errors += 1
+        idempotent_requests_total.inc(outcome="error")
+
+    async def run(self, user_id, key, request_body, fn):
+        """Returns (response body, replayed). `fn` is awaited only by the first request and returns the body."""
+        claim, body = await self.claim(user_id, key, request_body)
+        if body is not None:
+            return body, True
+        if claim is None:
+            return await fn(), False
+        task = self._detach(self._first(claim, fn))
+        # Shield: a client that disconnects must not cancel the work its retry will wait for
+        return await asyncio.shield(task), False
+
+    def stream(self, events):
+        """Iterate `events` to the end in a task of its own; returns a relay of its items.
+
+        For a claimed streaming response: the work (and its complete() or
+        abort()) then finishes whether the client stays, drops and retries,
+        or never reads the response at all.
+        """
+        queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for item in events:
+                    queue.put_nowait(item)
+            finally:
+                queue.put_nowait(None)
+
+        self._detach(produce())
+
+        async def relay():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield item
+
+        return relay()
+
+    def _detach(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self, timeout=LLM_DEADLINE_SECONDS):
+        """At shutdown: give first requests whose clients left the time to finish."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def claim(self, user_id, key, request_body):
+        """Reserve the key for this request, or wait for the request that holds it.
+
+        Returns (claim, None) when the caller must produce the response and
+        then pass `claim` to complete() or abort(); (None, stored body) for a
+        repeat; (None, None) when the key cannot be used (idempotency disabled,
+        or the store failed) and the request should simply run.
+        """
+        if self.store is None:
+            idempotent_requests_total.inc(outcome="disabled")
+            return None, None
+        try:
+            return await self._claim(f"user:{user_id}:{key}", request_fingerprint(request_body))
+        except sqlite3.Error as e:
+            self._error(e)
+            return None, None
+
+    async def _claim(self, key, fingerprint):
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + self.pending_ttl
+        existing = await self._call(self.store.begin, key, fingerprint, self.pending_ttl)
+        while True:
+            if existing is None:
+                idempotent_requests_total.inc(outcome="new")
+                self._results[key] = loop.create_future()
+                return key, None
+            stored_fingerprint, body = existing
+            if stored_fingerprint != fingerprint:
+                idempotent_requests_total.inc(outcome="mismatch")
+                raise IdempotencyKeyReused()
+            if body is not None:
+                idempotent_requests_total.inc(outcome="replayed")
+                return None, body
+            remaining = give_up_at - loop.time()
+            if remaining <= 0:
+                idempotent_requests_total.inc(outcome="in_progress")
+                raise IdempotencyInProgress()
+            result = self._results.get(key)
+            if result is not None:
+                try:
+                    body = await asyncio.wait_for(asyncio.shield(result), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                if body is not None:
+                    idempotent_requests_total.inc(outcome="attached")
+                    return None, body
+            else:
+                # Running on another worker: read (without the write lock) until it finishes or fails
+                await asyncio.sleep(min(self.poll, remaining))
+                existing = await self._call(self.store.get, key)
+                if existing is not None:
+                    continue
+            # The first request failed and released the key: claim it again
+            existing = await self._call(self.store.begin, key, fingerprint, self.pending_ttl)
+
+    async def complete(self, claim, body):
+        if claim is None:
+            return
+        self._resolve(claim, body)
+        try:
+            await self._call(self.store.complete, claim, body, self.ttl)
+        except sqlite3.Error as e:
+            self._error(e)  # the key stays pending until IDEMPOTENCY_PENDING_TTL_SECONDS
+
+    async def abort(self, claim):
+        """The request holding `claim` failed: release the key for the next attempt."""
+        if claim is None:
+            return
+        self._resolve(claim, None)
+        try:
+            await self._call(self.store.abort, claim)
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def _resolve(self, claim, body):
+        result = self._results.pop(claim, None)
+        if result is not None and not result.done():
+            result.set_result(body)
+
+    async def _first(self, claim, fn):
+        try:
+            body = await fn()
+        except BaseException:
+            await self.abort(claim)
+            raise
+        await self.complete(claim, body)
+        return body
+
+    def stats(self):
+        return {
+            "backend": IDEMPOTENCY_BACKEND,
+            "keys": len(self.store) if self.store is not None else 0,
+            "in_flight": len(self._results),
+            "errors": self.errors,
+        }
+
+
+def build_idempotency_store(name=IDEMPOTENCY_BACKEND):
+    if name == "memory":
+        return MemoryIdempotencyStore()
+    if name == "sqlite":
+        return SQLiteIdempotencyStore()
+    return None
+
+
+idempotent_requests = IdempotentRequests(build_idempotency_store())
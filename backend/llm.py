@@ -0,0 +1,261 @@
+import asyncio
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prompts import PROMPT_MODE, SYSTEM_INSTRUCTION
+
+# LLM configuration
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # "gemini" or "fake"
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gemini-2.5-flash")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Requests are shed (503) instead of queued once this many calls are waiting for a slot
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", 32))
+FAKE_LLM_LATENCY_MS = int(os.getenv("FAKE_LLM_LATENCY_MS", 800))
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", 0))
+FAKE_LLM_MALFORMED_RATE = float(os.getenv("FAKE_LLM_MALFORMED_RATE", 0))
+
+FAKE_RESPONSE = {
+    "summary": "You describe symptoms that have lasted a short time.",
+    "possible_common_causes": [
+        "This may be related to a common viral infection.",
+        "Sometimes symptoms like this are associated with stress or lack of sleep.",
+    ],
+    "severity_estimate": "Low Concern",
+    "self_care_tips": ["Rest", "Good hydration"],
+    "red_flags": ["Difficulty breathing", "Severe or worsening pain", "High fever that does not improve"],
+    "consultation_timing": "If symptoms last more than a few days or suddenly worsen.",
+    "disclaimer": "This response is for educational purposes only and is not a medical diagnosis or professional medical advice. If you are worried about your symptoms or they worsen, please consult a licensed healthcare professional.",
+}
+
+
+class FakeModelError(Exception):
+    code = 503  # treated like a provider-side "unavailable" error
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel.
+
+    Sleeps for a fixed latency and returns a canned JSON answer, so throughput
+    can be measured without spending API quota. A `failure_rate` fraction of
+    calls raise FakeModelError after the latency has elapsed, and a
+    `malformed_rate` fraction return truncated JSON.
+    """
+
+    def __init__(self, latency_ms=FAKE_LLM_LATENCY_MS, payload=None, failure_rate=FAKE_LLM_FAILURE_RATE,
+                 malformed_rate=FAKE_LLM_MALFORMED_RATE):
+        self.latency_ms = latency_ms
+        self.payload = payload or FAKE_RESPONSE
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        text = json.dumps(self.payload)
+        if stream:
+            return self._stream(text)
+        time.sleep(self.latency_ms / 1000)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeModelError("Injected fake LLM failure")
+        if self.malformed_rate and random.random() < self.malformed_rate:
+            return FakeResponse(text[:len(text) // 2])
+        return FakeResponse(text)
+
+    def _stream(self, text, chunks=8):
+        # Spread the latency over several chunks, like a real streamed answer
+        size = len(text) // chunks + 1
+        for i in range(0, len(text), size):
+            time.sleep(self.latency_ms / 1000 / chunks)
+            if i == 0 and self.failure_rate and random.random() < self.failure_rate:
+                raise FakeModelError("Injected fake LLM failure")
+            yield FakeResponse(text[i:i + size])
+
+
+def build_model():
+    """Return the configured model, or None when no backend is available."""
+    if LLM_BACKEND == "fake":
+        return FakeModel()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    # Imported here rather than at module level: the SDK is the slowest import of the whole backend
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    if PROMPT_MODE == "structured":
+        # Fixed rules are configured once instead of being resent inside every prompt
+        return genai.GenerativeModel(LLM_MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION)
+    return genai.GenerativeModel(LLM_MODEL_NAME)
+
+
+class LLMGate:
+    """Runs blocking generate_content calls in worker threads.
+
+    At most `limit` calls run at once; the rest wait on a semaphore and are
+    counted in `queue_depth` so the backlog can be observed.
+    """
+
+    def __init__(self, limit=LLM_MAX_CONCURRENCY, max_queue_depth=LLM_MAX_QUEUE_DEPTH):
+        self.limit = limit
+        self.max_queue_depth = max_queue_depth
+        self._semaphore = asyncio.Semaphore(limit)
+        # Dedicated threads: the loop's default executor is capped at cpu_count + 4,
+        # which would silently lower the concurrency limit on small machines
+        self._executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="llm")
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    async def _acquire(self):
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _release_from_thread(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # loop already closed (shutdown); nothing left to hand the slot to
+
+    async def call(self, fn, *args, **kwargs):
+        """Run a blocking SDK call in a worker thread once a concurrency slot is free.
+
+        The slot is held until the thread returns, even when the awaiting
+        coroutine is cancelled (e.g. by a deadline), since the SDK call
+        cannot be interrupted and still occupies the thread.
+        """
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release_from_thread(loop))
+        return await asyncio.wrap_future(future)
+
+    async def generate(self, model, prompt, **kwargs):
+        return await self.call(model.generate_content, prompt, **kwargs)
+
+    async def stream(self, model, prompt, **kwargs):
+        """Yield text chunks from a streaming generate_content call.
+
+        The blocking chunk iterator is drained in a worker thread and handed
+        to the event loop through a queue. As in call(), the slot is held
+        until that thread returns; a consumer that stops early (e.g. a
+        disconnected SSE client) only asks the thread to stop after its
+        current chunk.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for chunk in model.generate_content(prompt, stream=True, **kwargs):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        await self._acquire()
+        try:
+            producer = self._executor.submit(produce)
+        except BaseException:
+            self._release()
+            raise
+        producer.add_done_callback(lambda _: self._release_from_thread(loop))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+
+    @property
+    def overloaded(self):
+        return self.queue_depth >= self.max_queue_depth
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+        }
+
+
+class JSONSectionParser:
+    """Incrementally parses a streamed JSON object into its top-level fields.
+
+    Feed text as it arrives; each call returns the (key, value) pairs whose
+    values became complete. Anything before the opening brace (such as a
+    markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._field_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        fields = []
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._field_start = self._pos + 1
+            elif ch in "}]":
+                if self._depth == 1 and self._field_start is not None:
+                    fields.extend(self._complete_field())
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                fields.extend(self._complete_field())
+                self._field_start = self._pos + 1
+            self._pos += 1
+        return fields
+
+    def _complete_field(self):
+        segment = self.buffer[self._field_start:self._pos].strip()
+        if not segment:
+            return []
+        return list(json.loads("{" + segment + "}").items())
+
+
+llm_gate = LLMGate()
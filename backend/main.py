@@ -1,40 +1,107 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 import uvicorn
 from dotenv import load_dotenv
 import os
 import json
 import re
-from sqlalchemy.orm import Session
+import asyncio
+import base64
+import math
+import gzip
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, select
 from sqlalchemy.exc import IntegrityError
-from models import User, SymptomQuery, create_tables, get_db
-from auth import verify_password, get_password_hash, create_access_token, decode_access_token
-import google.generativeai as genai
+from models import User, SymptomQuery, week_bucket, AsyncSessionLocal, engine, async_engine, create_tables, get_async_db, materialize_history, parse_stored_response, response_if_missing
+from auth import get_password_hash_async, verify_and_update_password_async, shutdown_hash_executor, create_access_token, decode_access_token, AuthenticatedUser, user_cache
+from llm import llm_gate
+from providers import LLMClients, LLMUnavailable
+from writebehind import symptom_query_writer, WRITE_BEHIND_ENABLED
+from metrics import Gauge, RequestMetricsMiddleware, render_metrics, instrument_engine, stage_duration, llm_errors
+from cache import response_cache, symptom_flights, normalize_symptoms
+from ratelimit import rate_limiter, admission_rejections
+from search import history_search_query, search_terms
+from rollups import build_stats, history_version_query, stats_query
+from export import EXPORT_FORMATS, stream_export
+from triage import TriageResult, triage, triage_outcomes, raise_severity, emergency_response
+from retention import count_matching, delete_batches, retention_purger
+from idempotency import IDEMPOTENCY_MAX_KEY_LENGTH, IdempotencyInProgress, IdempotencyKeyReused, idempotent_requests
 
 # Load environment variables
 load_dotenv()
 
-# Create tables
-create_tables()
+# serve.py creates the tables once before starting its workers and turns this off
+CREATE_TABLES_ON_STARTUP = os.getenv("CREATE_TABLES_ON_STARTUP", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CREATE_TABLES_ON_STARTUP:
+        create_tables()
+    if WRITE_BEHIND_ENABLED:
+        symptom_query_writer.start()
+    retention_purger.start()
+    # Serve right away; the LLM SDK loads in the background
+    warm_up = asyncio.ensure_future(llm_clients.warm_up())
+    yield
+    # The server has stopped accepting connections and drained in-flight requests by now
+    warm_up.cancel()
+    # Keyed checks whose clients left still run; let them finish and queue their rows
+    await idempotent_requests.drain()
+    await symptom_query_writer.stop()
+    await retention_purger.stop()
+    shutdown_hash_executor()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Healthcare Symptom Checker API (Rewrite)",
     description="Strict AI Symptom Checker",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
 )
 
+# Batch limits: items per request, and how many of them may wait on the LLM at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+
+# Accounts (by email) allowed to export every user's history and run the retention purge
+# (EXPORT_ADMIN_EMAILS is the older name of the setting)
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", os.getenv("EXPORT_ADMIN_EMAILS", "")).split(",")
+    if email.strip()
+}
+
+# Bulk delete: most ids accepted per request
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", 1000))
+
+# History responses at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+
+# Metrics: DB statement timings from both engines, plus gauges read at scrape time
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+Gauge("llm_queue_depth", "LLM calls waiting for a concurrency slot", fn=lambda: llm_gate.queue_depth)
+Gauge("llm_in_flight", "LLM calls currently running", fn=lambda: llm_gate.in_flight)
+Gauge("response_cache_hits", "Response cache hits since start", fn=lambda: response_cache.hits)
+Gauge("response_cache_misses", "Response cache misses since start", fn=lambda: response_cache.misses)
+Gauge("user_cache_hit_ratio", "Authenticated-user cache hit ratio", fn=lambda: user_cache.stats()["hit_ratio"])
+Gauge("write_behind_pending_rows", "History rows waiting for the write-behind flush", fn=lambda: symptom_query_writer.pending)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Initialize OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Initialize Gemini client
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-
 # Pydantic models
 class SymptomRequest(BaseModel):
     symptoms: str
@@ -48,6 +115,24 @@ class StructuredSymptomResponse(BaseModel):
     consultation_timing: str
     disclaimer: str
 
+class BatchSymptomRequest(BaseModel):
+    items: List[SymptomRequest]
+
+class BatchItemResult(BaseModel):
+    index: int
+    result: Optional[StructuredSymptomResponse] = None
+    error: Optional[str] = None
+
+class BatchSymptomResponse(BaseModel):
+    results: List[BatchItemResult]
+
+class BulkDeleteRequest(BaseModel):
+    # Either ids, or a created_at range [start, end) with at least one bound
+    ids: Optional[List[int]] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    dry_run: bool = False
+
 class QueryHistoryResponse(BaseModel):
     id: int
     symptoms: str
@@ -73,7 +158,16 @@ class Token(BaseModel):
     token_type: str
 
 # Auth Helpers
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> AuthenticatedUser:
+    with stage_duration.time(stage="auth"):
+        return await resolve_user(token, db)
+
+async def require_admin(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+async def resolve_user(token: str, db: AsyncSession) -> AuthenticatedUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -82,22 +176,36 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     payload = decode_access_token(token)
     if payload is None:
         raise credentials_exception
+
+    # Fast path: tokens carry the immutable user id, resolved from the user cache
+    user_id = payload.get("uid")
+    if user_id is not None:
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        user = await db.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        cached = AuthenticatedUser.from_user(user)
+        user_cache.put(cached)
+        return cached
+
     username: str = payload.get("sub")
     if username is None:
         raise credentials_exception
     
-    # Try finding by username first (legacy) then email
-    user = db.query(User).filter(User.username == username).first()
+    # Tokens issued before ids were embedded: try finding by username first (legacy) then email
+    user = (await db.execute(select(User).where(User.username == username))).scalars().first()
     if not user:
-         user = db.query(User).filter(User.email == username).first()
+         user = (await db.execute(select(User).where(User.email == username))).scalars().first()
          
     if user is None:
         raise credentials_exception
-    return user
+    return AuthenticatedUser.from_user(user)
 
 # Endpoints
 @app.post("/register/", response_model=UserResponse)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # 1. Validate Email
     email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     if not re.match(email_regex, user.email):
@@ -108,192 +216,621 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters long")
 
     # 3. Check Email Uniqueness (Username can be duplicate)
-    db_user_email = db.query(User).filter(User.email == user.email).first()
+    db_user_email = (await db.execute(select(User).where(User.email == user.email))).scalars().first()
     if db_user_email:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     new_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     return UserResponse(id=new_user.id, username=new_user.username, email=new_user.email)
 
 @app.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     # Authenticate using Email (passed as username field in OAuth2 form)
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = (await db.execute(select(User).where(User.email == form_data.username))).scalars().first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    valid, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash:
+        # Stored hash used a different BCRYPT_ROUNDS; upgrade it now that we know the password
+        user.hashed_password = new_hash
+        await db.commit()
     
     # Store email in token subject for consistency, or username. 
     # Let's store username to keep "Welcome (username)" easy, or store email and fetch user.
     # Storing username in sub is standard for this app so far.
-    access_token = create_access_token(data={"sub": user.username}) 
+    # "uid" lets get_current_user resolve the user without a DB lookup.
+    access_token = create_access_token(data={"sub": user.username, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/check_symptoms/", response_model=StructuredSymptomResponse)
-async def check_symptoms(request: SymptomRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=500, detail="LLM Service Unavailable: Missing API Key.")
+def parse_analysis(response_content: str):
+    """Validate raw LLM JSON; raises when the answer does not match StructuredSymptomResponse."""
+    with stage_duration.time(stage="parse"):
+        return response_content, StructuredSymptomResponse(**json.loads(response_content))
 
-    prompt = f"""
-    You are an AI-powered Healthcare Symptom Checker designed for informational and educational purposes only.
-    You are NOT a medical professional, and you must NEVER provide a diagnosis, medication names, or treatment dosage.
-
-    Your role is to analyze the user's symptoms: "{request.symptoms}"
-    
-    Provide possible common explanations, supportive guidance, and safe recommendations while maintaining a responsible tone.
-
-    Every response must ALWAYS follow the exact structure below, regardless of the input:
-
-    ----------------------------------------------------
-    RESPONSE TEMPLATE (STRICT FORMAT):
-
-    📝 Summary:
-    Rewrite the user’s symptoms in simple, clear language.
-
-    🔍 Possible Common Causes (not a diagnosis):
-    List 2–5 possible common causes. Use phrasing like:
-    - "This may be related to..."
-    - "Sometimes symptoms like this are associated with..."
-    Do NOT sound certain. Avoid any definitive diagnosis.
-
-    🎯 Severity Estimate:
-    Classify as one of the following, based on impact on daily activities:
-    - Low Concern
-    - Moderate Concern
-    - High Concern
-
-    💡 Helpful Self-Care Tips:
-    Suggest only safe, general, non-medical advice such as:
-    - Rest
-    - Warm compress
-    - Gentle stretching
-    - Good hydration
-    - Ergonomic posture
-    Avoid medication, prescriptions, or exercises that could worsen injury.
-
-    🚩 Seek Medical Care If You Notice:
-    Provide 3–6 red flag warnings relevant to symptoms.
-    Examples:
-    - Numbness or weakness
-    - Difficulty breathing
-    - Severe or worsening pain
-    - Loss of bladder/bowel control
-
-    📅 When to Consider Consultation:
-    Give a general timeframe such as:
-    - If symptoms last more than a few days
-    - If symptoms interfere with walking or daily life
-    - If symptoms suddenly worsen
-
-    ⚠️ Disclaimer (MANDATORY):
-    “This response is for educational purposes only and is not a medical diagnosis or professional medical advice. If you are worried about your symptoms or they worsen, please consult a licensed healthcare professional.”
-    ----------------------------------------------------
-
-    ADDITIONAL RULES:
-    - NEVER claim certainty.
-    - NEVER mention medications, side effects, or treatment steps.
-    - NEVER ask for personal information.
-    - Maintain a calm, helpful, and non-alarming tone.
-    - If symptoms indicate any emergency pattern, classify severity as HIGH and politely encourage urgent professional help.
-
-    Return the response as a valid JSON object matching this structure:
-    {{
-        "summary": "...",
-        "possible_common_causes": ["...", "..."],
-        "severity_estimate": "...",
-        "self_care_tips": ["...", "..."],
-        "red_flags": ["...", "..."],
-        "consultation_timing": "...",
-        "disclaimer": "..."
-    }}
-    """
-    
+async def generate_analysis(symptoms: str):
+    """Run one routed LLM call for `symptoms`; returns the raw JSON and the parsed response."""
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json"
-            )
+        # Providers run their blocking SDK calls off the event loop, bounded by LLM_MAX_CONCURRENCY
+        with stage_duration.time(stage="llm"):
+            _, llm_router = await llm_clients.get()
+            _, response_content, response_obj = await llm_router.generate(symptoms)
+    except Exception as e:
+        llm_errors.inc(error=type(e).__name__)
+        raise
+    await response_cache.set(symptoms, response_content)
+    return response_content, response_obj
+
+# LLM client (Gemini, or the offline fake when LLM_BACKEND=fake) and the router across the
+# configured providers (LLM_PROVIDERS), hedging slow calls; built lazily in each worker
+llm_clients = LLMClients(parse_analysis)
+
+async def analyze_symptoms(symptoms: str):
+    """Answer from the response cache, or share a single LLM call with identical in-flight requests."""
+    cached = await response_cache.get(symptoms)
+    if cached is not None:
+        return cached, StructuredSymptomResponse(**json.loads(cached))
+    return await symptom_flights.do(normalize_symptoms(symptoms), lambda: generate_analysis(symptoms))
+
+def triage_symptoms(symptoms: str) -> TriageResult:
+    """Match red-flag phrases locally; runs before admission control so emergencies are never shed."""
+    with stage_duration.time(stage="triage"):
+        result = triage(symptoms)
+    triage_outcomes.inc(outcome="emergency" if result.emergency else "hint" if result.severity else "none")
+    return result
+
+def emergency_answer(result: TriageResult):
+    response_obj = StructuredSymptomResponse(**emergency_response(result))
+    return json.dumps(response_obj.dict()), response_obj
+
+def apply_triage_hint(result: TriageResult, response_content: str, response_obj: StructuredSymptomResponse):
+    """Raise the LLM's severity to the pre-triage floor (High Concern for emergency red flags, else Moderate)."""
+    severity = raise_severity(response_obj.severity_estimate, result.severity)
+    if severity == response_obj.severity_estimate:
+        return response_content, response_obj
+    response_obj = response_obj.copy(update={"severity_estimate": severity})
+    return json.dumps(response_obj.dict()), response_obj
+
+def new_symptom_query(user_id: int, symptoms: str, response_content: str, response_obj: StructuredSymptomResponse) -> SymptomQuery:
+    return SymptomQuery(
+        user_id=user_id,
+        symptoms=symptoms,
+        response=response_content,
+        **materialize_history(response_obj.dict())
+    )
+
+async def save_symptom_queries(rows: List[SymptomQuery], db: Optional[AsyncSession] = None):
+    """Persist new history rows: queued for the write-behind task when enabled, else committed now."""
+    if symptom_query_writer.running:
+        symptom_query_writer.enqueue(rows)
+        return
+    with stage_duration.time(stage="db_commit"):
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                db.add_all(rows)
+                await db.commit()
+            return
+        db.add_all(rows)
+        await db.commit()
+
+async def admit_llm_request(user_id: int, cost: int = 1):
+    """Refuse work up front: 503 while the LLM queue is full, 429 once the user's token bucket is empty."""
+    if llm_gate.overloaded:
+        admission_rejections.inc(reason="overloaded")
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly", headers={"Retry-After": "1"})
+    retry_after = await rate_limiter.check(user_id, cost)
+    if retry_after:
+        admission_rejections.inc(reason="rate_limited")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many symptom checks, please slow down",
+            headers={"Retry-After": str(math.ceil(retry_after))},
         )
-        response_content = response.text
-        
-        # Clean up potential markdown code blocks
-        if "```json" in response_content:
-            response_content = response_content.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_content:
-            response_content = response_content.split("```")[1].split("```")[0].strip()
 
-        data = json.loads(response_content)
-        
-        response_obj = StructuredSymptomResponse(**data)
+async def run_symptom_check(symptoms: str, user_id: int, db: Optional[AsyncSession] = None) -> StructuredSymptomResponse:
+    """Triage, then answer from the cache or the LLM, and save the check to history."""
+    triage_result = triage_symptoms(symptoms)
+    if triage_result.emergency:
+        # Answered locally in microseconds; no LLM round-trip for an emergency
+        response_content, response_obj = emergency_answer(triage_result)
+        await save_symptom_queries([new_symptom_query(user_id, symptoms, response_content, response_obj)], db)
+        return response_obj
+
+    _, llm_router = await llm_clients.get()
+    if not llm_router.providers:
+        raise HTTPException(status_code=500, detail="LLM Service Unavailable: Missing API Key.")
+    await admit_llm_request(user_id)
+
+    try:
+        response_content, response_obj = apply_triage_hint(triage_result, *await analyze_symptoms(symptoms))
         
-        # Save to DB
-        query = SymptomQuery(
-            user_id=current_user.id,
-            symptoms=request.symptoms,
-            response=response_content
-        )
-        db.add(query)
-        db.commit()
+        # Save to DB (cached answers too, so history stays complete)
+        await save_symptom_queries([new_symptom_query(user_id, symptoms, response_content, response_obj)], db)
         
         return response_obj
         
+    except LLMUnavailable as e:
+        print(f"LLM Error: {e}")
+        # Open circuits fail fast; tell the client when the next probe will be allowed
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after is not None else None
+        raise HTTPException(status_code=e.status_code, detail=f"LLM Service Unavailable: {str(e)}", headers=headers)
     except Exception as e:
         print(f"LLM Error: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing symptoms: {str(e)}")
 
-@app.get("/history/", response_model=List[QueryHistoryResponse])
-async def get_history(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    queries = db.query(SymptomQuery).filter(SymptomQuery.user_id == current_user.id).order_by(SymptomQuery.created_at.desc()).limit(20).all()
-    history = []
-    for q in queries:
+def idempotency_conflict(e: Exception) -> HTTPException:
+    if isinstance(e, IdempotencyKeyReused):
+        return HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress", headers={"Retry-After": "1"})
+
+@app.post("/check_symptoms/", response_model=StructuredSymptomResponse)
+async def check_symptoms(
+    request: SymptomRequest,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=IDEMPOTENCY_MAX_KEY_LENGTH),
+):
+    """Analyze symptoms and save them to history.
+
+    With an `Idempotency-Key` header, a repeat within IDEMPOTENCY_TTL_SECONDS
+    returns the first response (marked `Idempotent-Replayed: true`) without an
+    LLM call or a new history row; a repeat arriving while the first request
+    is still running waits for it.
+    """
+    if not idempotency_key:
+        return await run_symptom_check(request.symptoms, current_user.id, db)
+
+    async def first_response():
+        # Own session: the work may outlive this request if its client gives up and retries
+        response_obj = await run_symptom_check(request.symptoms, current_user.id)
+        return json.dumps(response_obj.dict())
+
+    try:
+        body, replayed = await idempotent_requests.run(current_user.id, idempotency_key, request.symptoms, first_response)
+    except (IdempotencyKeyReused, IdempotencyInProgress) as e:
+        raise idempotency_conflict(e)
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.post("/check_symptoms/batch", response_model=BatchSymptomResponse)
+async def check_symptoms_batch(request: BatchSymptomRequest, current_user: AuthenticatedUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    _, llm_router = await llm_clients.get()
+    if not llm_router.providers:
+        raise HTTPException(status_code=500, detail="LLM Service Unavailable: Missing API Key.")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch too large (max {BATCH_MAX_ITEMS} items)")
+    triage_results = [triage_symptoms(item.symptoms) for item in request.items]
+    llm_items = sum(1 for result in triage_results if not result.emergency)
+    if llm_items:
+        await admit_llm_request(current_user.id, cost=llm_items)
+
+    # Per-batch bound, on top of the global LLM gate, so one batch cannot take every slot
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run(index: int, item: SymptomRequest):
+        triage_result = triage_results[index]
+        if triage_result.emergency:
+            response_content, response_obj = emergency_answer(triage_result)
+            return BatchItemResult(index=index, result=response_obj), new_symptom_query(current_user.id, item.symptoms, response_content, response_obj)
+        async with semaphore:
+            try:
+                response_content, response_obj = apply_triage_hint(triage_result, *await analyze_symptoms(item.symptoms))
+            except Exception as e:
+                print(f"LLM Error: {e}")
+                return BatchItemResult(index=index, error=f"Error processing symptoms: {str(e)}"), None
+        row = new_symptom_query(current_user.id, item.symptoms, response_content, response_obj)
+        return BatchItemResult(index=index, result=response_obj), row
+
+    outcomes = await asyncio.gather(*(run(i, item) for i, item in enumerate(request.items)))
+
+    # Persist every successful item in one transaction
+    await save_symptom_queries([row for _, row in outcomes if row is not None], db)
+
+    return BatchSymptomResponse(results=[result for result, _ in outcomes])
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/check_symptoms/stream")
+async def check_symptoms_stream(
+    request: SymptomRequest,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=IDEMPOTENCY_MAX_KEY_LENGTH),
+):
+    """Server-sent events: one `section` event per completed field, then `done` (or `error`).
+
+    Fields stream as they arrive when the primary provider supports it; otherwise
+    they are sent together once the routed answer is complete. An `Idempotency-Key`
+    works as on /check_symptoms/ (and shares its keys): the first request's work
+    runs detached from its connection, and a repeat gets the stored answer as a
+    single `done` event, marked `Idempotent-Replayed: true`, waiting for it if needed.
+    """
+    triage_result = triage_symptoms(request.symptoms)
+    _, llm_router = await llm_clients.get()
+    if not triage_result.emergency and not llm_router.providers:
+        raise HTTPException(status_code=500, detail="LLM Service Unavailable: Missing API Key.")
+    user_id = current_user.id
+    headers = {"Cache-Control": "no-cache"}
+
+    claim = None
+    if idempotency_key:
+        try:
+            claim, body = await idempotent_requests.claim(user_id, idempotency_key, request.symptoms)
+        except (IdempotencyKeyReused, IdempotencyInProgress) as e:
+            raise idempotency_conflict(e)
+        if body is not None:
+            replay = sse_event("done", json.loads(body))
+            return StreamingResponse(iter([replay]), media_type="text/event-stream", headers={**headers, "Idempotent-Replayed": "true"})
+
+    try:
+        if not triage_result.emergency:
+            retry_after = llm_router.retry_after()
+            if retry_after > 0:
+                # Every circuit is open: fail fast, before the event stream starts
+                raise HTTPException(
+                    status_code=503,
+                    detail="LLM Service Unavailable: all providers are failing",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+            await admit_llm_request(user_id)
+    except BaseException:
+        await idempotent_requests.abort(claim)
+        raise
+
+    def section(key, value):
+        if key == "severity_estimate":
+            value = raise_severity(value, triage_result.severity)
+        return sse_event("section", {"key": key, "value": value})
+
+    async def events():
+        stored = False
         try:
-            data = json.loads(q.response)
-            # Default values if parsing fails or old data
-            summary = data.get("summary", "Analysis available")
-            causes = data.get("possible_common_causes", [])
-            severity = data.get("severity_estimate", "Unknown")
-            tips = data.get("self_care_tips", [])
-            red_flags = data.get("red_flags", [])
-            
-            # Fallback for old data format
-            if not summary and "possible_conditions" in data:
-                 first_cond = data.get("possible_conditions", [{}])[0].get("condition", "Unknown")
-                 summary = f"Possible: {first_cond}"
-
-        except:
-            summary = "Analysis available"
-            causes = []
-            severity = "Unknown"
-            tips = []
-            red_flags = []
-            
-        history.append(QueryHistoryResponse(
-            id=q.id,
-            symptoms=q.symptoms,
-            created_at=q.created_at.strftime("%d %b %Y"), # Formatted date
-            summary=summary,
-            possible_common_causes=causes,
-            severity_estimate=severity,
-            self_care_tips=tips,
-            red_flags=red_flags
+            if triage_result.emergency:
+                response_content, _ = emergency_answer(triage_result)
+            else:
+                response_content = await response_cache.get(request.symptoms)
+            cache_hit = response_content is not None
+            if cache_hit:
+                response_obj = StructuredSymptomResponse(**json.loads(response_content))
+                for key, value in json.loads(response_content).items():
+                    yield section(key, value)
+            else:
+                try:
+                    with stage_duration.time(stage="llm_stream"):
+                        async for kind, item in llm_router.stream(request.symptoms):
+                            if kind == "section":
+                                yield section(*item)
+                            else:
+                                _, response_content, response_obj = item
+                except Exception as e:
+                    llm_errors.inc(error=type(e).__name__)
+                    raise
+                await response_cache.set(request.symptoms, response_content)
+            response_content, response_obj = apply_triage_hint(triage_result, response_content, response_obj)
+
+            await save_symptom_queries([new_symptom_query(user_id, request.symptoms, response_content, response_obj)])
+            # Stored before `done` goes out: a client that retries from here on gets a replay, not a second row
+            await idempotent_requests.complete(claim, json.dumps(response_obj.dict()))
+            stored = True
+
+            yield sse_event("done", response_obj.dict())
+        except LLMUnavailable as e:
+            print(f"LLM Error: {e}")
+            yield sse_event("error", {"detail": f"LLM Service Unavailable: {str(e)}", "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            yield sse_event("error", {"detail": f"Error processing symptoms: {str(e)}"})
+        finally:
+            # Failed: its retry runs again
+            if not stored:
+                await idempotent_requests.abort(claim)
+
+    if claim is not None:
+        # Not tied to this connection: a client that drops and retries with the key attaches to this run
+        return StreamingResponse(idempotent_requests.stream(events()), media_type="text/event-stream", headers=headers)
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "llm_ready": llm_clients.ready}
+
+@app.get("/llm/status")
+async def llm_status():
+    _, llm_router = await llm_clients.get()
+    return {**llm_gate.stats(), "providers": llm_router.stats(), "rate_limit": rate_limiter.stats()}
+
+@app.get("/db/status")
+async def db_status():
+    return {"write_behind": symptom_query_writer.stats()}
+
+@app.get("/cache/status")
+async def cache_status():
+    return {
+        **response_cache.stats(),
+        "single_flight": symptom_flights.stats(),
+        "users": user_cache.stats(),
+        "idempotency": idempotent_requests.stats(),
+    }
+
+@app.get("/retention/status")
+async def retention_status():
+    return retention_purger.stats()
+
+@app.post("/retention/run")
+async def run_retention(dry_run: bool = False, days: Optional[int] = Query(None, ge=1), admin: AuthenticatedUser = Depends(require_admin)):
+    """Run the retention purge now (RETENTION_DAYS unless `days` is given) and return its summary."""
+    try:
+        return await retention_purger.run_once(dry_run=dry_run, days=days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def history_item_json(q) -> str:
+    """Serialize one history row from its materialized columns, without re-parsing JSON."""
+    summary, severity, details = q.summary, q.severity_estimate, q.details
+    if details is None:
+        # Row written before materialization and not yet backfilled
+        fields = materialize_history(parse_stored_response(q.response))
+        summary, severity, details = fields["summary"], fields["severity_estimate"], fields["details"]
+    return '{"id":%d,"symptoms":%s,"created_at":%s,"summary":%s,"severity_estimate":%s,%s}' % (
+        q.id,
+        json.dumps(q.symptoms),
+        json.dumps(q.created_at.strftime("%d %b %Y")),  # Formatted date
+        json.dumps(summary),
+        json.dumps(severity),
+        details[1:-1],
+    )
+
+def encode_cursor(*values: str) -> str:
+    """Opaque page cursor holding `values` (for /history/, the sort key of a page's last row)."""
+    return base64.urlsafe_b64encode("|".join(values).encode()).decode()
+
+def decode_cursor(cursor: str, *parsers):
+    """The values of an encode_cursor() cursor, each read with its parser; 400 if it is malformed."""
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(values) != len(parsers):
+            raise ValueError(cursor)
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_ids(value: str) -> List[int]:
+    return [int(query_id) for query_id in value.split(",")]
+
+# Columns history_item_json needs
+HISTORY_COLUMNS = (
+    SymptomQuery.id,
+    SymptomQuery.symptoms,
+    SymptomQuery.created_at,
+    SymptomQuery.summary,
+    SymptomQuery.severity_estimate,
+    SymptomQuery.details,
+    # The raw response is only needed for rows that have not been backfilled
+    response_if_missing(SymptomQuery.details),
+)
+
+async def history_etag(db: AsyncSession, user_id: int, *parts) -> str:
+    """Weak ETag for anything derived from the user's history: their history version, one primary-key lookup.
+
+    Read it before the rows: a change in between then only costs one extra 200, never a stale 304.
+    """
+    version = (await db.execute(history_version_query(user_id))).scalar() or 0
+    return 'W/"%s"' % "-".join(str(part) for part in (user_id, version, *parts))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: the same entity is served gzipped or not
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in header.split(","))
+
+def cache_headers(etag: str) -> dict:
+    # Clients may keep the body but must revalidate it every time
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization, Accept-Encoding"}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+def json_response(request: Request, body: str, etag: str, headers: Optional[dict] = None) -> Response:
+    """JSON response carrying `etag`, gzipped when large enough and the client accepts it."""
+    headers = {**(headers or {}), **cache_headers(etag)}
+    content = body.encode()
+    if len(content) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        content = gzip.compress(content, GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=content, media_type="application/json", headers=headers)
+
+@app.get("/history/", response_model=List[QueryHistoryResponse])
+async def get_history(
+    request: Request,
+    before: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Newest-first history page. Pass the `X-Next-Cursor` response header as `before` to get the next page.
+
+    Sends an ETag; a matching `If-None-Match` gets a 304 without reading any history rows.
+    """
+    etag = await history_etag(db, current_user.id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    query = select(*HISTORY_COLUMNS).where(SymptomQuery.user_id == current_user.id)
+    if before:
+        created_at, query_id = decode_cursor(before, datetime.fromisoformat, int)
+        query = query.where(or_(
+            SymptomQuery.created_at < created_at,
+            and_(SymptomQuery.created_at == created_at, SymptomQuery.id < query_id),
         ))
-    return history
+    # Fetch one extra row to learn whether another page exists
+    query = query.order_by(SymptomQuery.created_at.desc(), SymptomQuery.id.desc()).limit(limit + 1)
+    queries = (await db.execute(query)).all()
+
+    headers = {}
+    if len(queries) > limit:
+        queries = queries[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(queries[-1].created_at.isoformat(), str(queries[-1].id))
+
+    body = "[" + ",".join(history_item_json(q) for q in queries) + "]"
+    return json_response(request, body, etag, headers)
+
+async def latest_history_item_json(db: AsyncSession, user_id: int) -> str:
+    """The newest history entry as JSON ("null" when there is none): one index seek."""
+    query = (
+        select(*HISTORY_COLUMNS)
+        .where(SymptomQuery.user_id == user_id)
+        .order_by(SymptomQuery.created_at.desc(), SymptomQuery.id.desc())
+        .limit(1)
+    )
+    row = (await db.execute(query)).first()
+    return history_item_json(row) if row is not None else "null"
+
+@app.get("/history/latest", response_model=Optional[QueryHistoryResponse])
+async def get_latest_history(request: Request, current_user: AuthenticatedUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """The most recent check only, for previews."""
+    etag = await history_etag(db, current_user.id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return json_response(request, await latest_history_item_json(db, current_user.id), etag)
+
+@app.get("/stats")
+async def get_stats(
+    request: Request,
+    weeks: int = Query(12, ge=1, le=104),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Dashboard summary from the rollup table: counts by severity and by week, plus the latest check.
+
+    Cost depends on `weeks`, not on how much history the user has.
+    """
+    # The weekly series also shifts when a new week starts
+    etag = await history_etag(db, current_user.id, week_bucket(datetime.utcnow()))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    rows = (await db.execute(stats_query(current_user.id, weeks))).all()
+    stats = json.dumps(build_stats(rows, weeks))
+    latest = await latest_history_item_json(db, current_user.id)
+    return json_response(request, '%s,"latest":%s}' % (stats[:-1], latest), etag)
+
+@app.get("/history/search", response_model=List[QueryHistoryResponse])
+async def search_history(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    before: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Full-text search of the user's symptoms and summaries, best match first. Paged like /history/.
+
+    The first page ranks up to SEARCH_MAX_RESULTS matches at once and the cursor
+    carries the ids still to come, so later pages follow that ranking exactly:
+    relevance scores, which shift with every write to the search index, are
+    never compared across requests. Entries deleted since are skipped; entries
+    added since only show up in a new search.
+    """
+    if not search_terms(q):
+        raise HTTPException(status_code=400, detail="Search query has no searchable words")
+    ranked_ids = decode_cursor(before, parse_ids)[0] if before else None
+    etag = await history_etag(db, current_user.id)
+    if ranked_ids is None:
+        query = history_search_query(async_engine.dialect.name, current_user.id, q)
+        if query is None:
+            raise HTTPException(status_code=501, detail="Full-text search is not available on this database")
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        ranked_ids = (await db.execute(query)).scalars().all()
+    elif etag_matches(request, etag):
+        return not_modified(etag)
+
+    page_ids, rest = ranked_ids[:limit], ranked_ids[limit:]
+    rows = {}
+    if page_ids:
+        query = select(*HISTORY_COLUMNS).where(SymptomQuery.user_id == current_user.id, SymptomQuery.id.in_(page_ids))
+        rows = {row.id: row for row in (await db.execute(query)).all()}
+
+    headers = {}
+    if rest:
+        headers["X-Next-Cursor"] = encode_cursor(",".join(map(str, rest)))
+
+    body = "[" + ",".join(history_item_json(rows[query_id]) for query_id in page_ids if query_id in rows) + "]"
+    return json_response(request, body, etag, headers)
+
+def export_response(fmt: str, user_id: Optional[int], filename: str):
+    # The generator opens its own session: it outlives the request's dependencies
+    return StreamingResponse(
+        stream_export(AsyncSessionLocal, fmt, user_id),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+@app.get("/export/history")
+async def export_history(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """Stream the user's full history as NDJSON or CSV, oldest first."""
+    return export_response(fmt, current_user.id, f"history-{current_user.id}")
+
+@app.get("/export/history/all")
+async def export_all_history(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    admin: AuthenticatedUser = Depends(require_admin),
+):
+    """Stream every user's history; restricted to ADMIN_EMAILS."""
+    return export_response(fmt, None, "history-all")
 
 @app.delete("/history/{query_id}")
-async def delete_history(query_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    query = db.query(SymptomQuery).filter(SymptomQuery.id == query_id, SymptomQuery.user_id == current_user.id).first()
+async def delete_history(query_id: int, current_user: AuthenticatedUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    query = (await db.execute(
+        select(SymptomQuery).where(SymptomQuery.id == query_id, SymptomQuery.user_id == current_user.id)
+    )).scalars().first()
     if not query:
         raise HTTPException(status_code=404, detail="History item not found")
     
-    db.delete(query)
-    db.commit()
+    await db.delete(query)
+    await db.commit()
     return {"message": "Deleted successfully"}
 
+def to_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    # created_at is stored as naive UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+@app.post("/history/bulk_delete")
+async def bulk_delete_history(request: BulkDeleteRequest, current_user: AuthenticatedUser = Depends(get_current_user)):
+    """Delete the user's history by ids or by created_at range, in short batched transactions."""
+    has_range = request.start is not None or request.end is not None
+    if (request.ids is not None) == has_range:
+        raise HTTPException(status_code=400, detail="Give either ids or a start/end range")
+    conditions = [SymptomQuery.user_id == current_user.id]
+    if request.ids is not None:
+        if len(request.ids) > BULK_DELETE_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"Too many ids (max {BULK_DELETE_MAX_IDS})")
+        conditions.append(SymptomQuery.id.in_(request.ids))
+    if request.start is not None:
+        conditions.append(SymptomQuery.created_at >= to_utc_naive(request.start))
+    if request.end is not None:
+        conditions.append(SymptomQuery.created_at < to_utc_naive(request.end))
+
+    if request.dry_run:
+        return {"dry_run": True, "matched": await count_matching(AsyncSessionLocal, conditions)}
+    deleted = 0
+    async for count in delete_batches(AsyncSessionLocal, conditions, "bulk_delete"):
+        deleted += count
+    return {"dry_run": False, "deleted": deleted}
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 9002))
     uvicorn.run(app, host="127.0.0.1", port=port)
@@ -0,0 +1,216 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Minimal Prometheus text-format metrics (no client library needed)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A settable gauge, or a callback gauge when `fn` is given (read at scrape time)."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), fn=None):
+        super().__init__(name, documentation, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.fn is not None:
+            self.set(self.fn())
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route and status code", ("method", "route", "status")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served")
+
+# Request pipeline stages: auth, prompt, llm, parse, db_commit
+stage_duration = Histogram(
+    "request_stage_seconds", "Time spent in each stage of request handling", ("stage",)
+)
+llm_prompt_bytes = Histogram("llm_prompt_bytes", "Size of prompts sent to the LLM", buckets=SIZE_BUCKETS)
+llm_response_bytes = Histogram("llm_response_bytes", "Size of LLM response text", buckets=SIZE_BUCKETS)
+llm_errors = Counter("llm_errors_total", "Failed LLM calls by exception type", ("error",))
+
+# Database
+db_query_duration = Histogram("db_query_duration_seconds", "SQL statement latency by operation", ("operation",))
+
+
+def instrument_engine(engine):
+    """Time every statement executed on a (sync) SQLAlchemy engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        _observe(conn, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # A failed statement gets no after_cursor_execute: drop its start time here
+        if context.connection is not None and context.statement is not None and context.connection.info.get("query_start"):
+            _observe(context.connection, context.statement)
+
+
+def _observe(conn, statement):
+    start = conn.info["query_start"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+    db_query_duration.observe(time.perf_counter() - start, operation=operation)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording http_request_duration and http_requests_in_flight.
+
+    A request counts until the last chunk of its body has been sent, so
+    streamed responses (server-sent events, exports) are timed to completion
+    rather than to their headers as with @app.middleware("http").
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        status_code = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            http_requests_in_flight.dec()
+            route = scope.get("route")  # set by the router once the request is matched
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=status_code,
+            )
+
+        async def send_and_record(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            finish()
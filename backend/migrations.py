@@ -0,0 +1,61 @@
+"""One-off data migrations.
+
+Run from the backend directory, e.g.:
+
+    python migrations.py backfill_history
+"""
+import sys
+
+from sqlalchemy import update
+
+from models import SessionLocal, SymptomQuery, add_missing_indexes, create_tables, materialize_history, parse_stored_response, rebuild_rollups
+
+
+def backfill_history(chunk_size=500):
+    """Fill summary/severity/details for rows written before they were materialized.
+
+    Rows are processed in primary-key order, one committed chunk at a time, so
+    the migration holds no long locks and can be stopped and resumed.
+    """
+    create_tables()
+    db = SessionLocal()
+    last_id = 0
+    total = 0
+    try:
+        while True:
+            rows = (
+                db.query(SymptomQuery.id, SymptomQuery.response)
+                .filter(SymptomQuery.id > last_id, SymptomQuery.details.is_(None))
+                .order_by(SymptomQuery.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            db.execute(
+                update(SymptomQuery),
+                [{"id": row.id, **materialize_history(parse_stored_response(row.response))} for row in rows],
+            )
+            db.commit()
+            last_id = rows[-1].id
+            total += len(rows)
+            print(f"Backfilled {total} rows (last id {last_id})")
+    finally:
+        db.close()
+    if total:
+        # Backfilled severities were counted as "Unknown" until now
+        rebuild_rollups()
+    return total
+
+
+MIGRATIONS = {
+    "backfill_history": backfill_history,
+    "add_indexes": add_missing_indexes,
+    "rebuild_rollups": rebuild_rollups,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        print(f"Usage: python migrations.py [{'|'.join(MIGRATIONS)}]")
+        sys.exit(1)
+    MIGRATIONS[sys.argv[1]]()
@@ -1,7 +1,10 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime
+from collections import Counter
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Text, DateTime
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import case, create_engine, delete, event, insert, inspect, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 import datetime
+import json
 
 Base = declarative_base()
 
@@ -22,6 +25,71 @@ class SymptomQuery(Base):
     symptoms = Column(Text)
     response = Column(Text)  # JSON string of the LLM response
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Materialized at write time so history reads never re-parse `response`
+    summary = Column(Text)
+    severity_estimate = Column(String(50))
+    details = Column(Text)  # Compact JSON: causes, self-care tips and red flags
+
+    __table_args__ = (
+        # Serves per-user history pages in keyset order
+        Index("ix_symptom_queries_user_created", "user_id", created_at.desc(), id.desc()),
+        # Serves the retention purge (oldest rows across all users)
+        Index("ix_symptom_queries_created", "created_at"),
+    )
+
+class SymptomQueryRollup(Base):
+    """Per-user history counts, kept up to date on every insert and delete (see rollups.py)
+    so the dashboard never has to scan a user's history."""
+    __tablename__ = "symptom_query_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    kind = Column(String(16), primary_key=True)  # "severity", "week" or "version"
+    # severity label, the Monday (YYYY-MM-DD) of the week, or "" for the version
+    bucket = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+def week_bucket(created_at) -> str:
+    return (created_at - datetime.timedelta(days=created_at.weekday())).date().isoformat()
+
+def history_severity(severity_estimate, response):
+    """Severity a history row is counted under; rows never backfilled carry it only in `response`."""
+    if severity_estimate is not None:
+        return severity_estimate
+    return materialize_history(parse_stored_response(response))["severity_estimate"]
+
+def response_if_missing(column):
+    """`response` for rows whose backfilled `column` is still NULL (and only those), labelled "response"."""
+    return case((column.is_(None), SymptomQuery.response)).label("response")
+
+def rollup_keys(user_id, severity_estimate, created_at):
+    """The rollup rows one history entry counts towards."""
+    return [(user_id, "severity", severity_estimate or "Unknown"), (user_id, "week", week_bucket(created_at))]
+
+def parse_stored_response(response_text):
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def materialize_history(data: dict) -> dict:
+    """Build the materialized SymptomQuery columns from a parsed LLM response."""
+    summary = data.get("summary")
+    # Fallback for old data format
+    if not summary and data.get("possible_conditions"):
+        first_cond = data["possible_conditions"][0]
+        if isinstance(first_cond, dict):
+            summary = f"Possible: {first_cond.get('condition', 'Unknown')}"
+    details = {
+        "possible_common_causes": data.get("possible_common_causes", []),
+        "self_care_tips": data.get("self_care_tips", []),
+        "red_flags": data.get("red_flags", []),
+    }
+    return {
+        "summary": summary or "Analysis available",
+        "severity_estimate": data.get("severity_estimate", "Unknown"),
+        "details": json.dumps(details, separators=(",", ":")),
+    }
 
 # Database setup
 import os
@@ -32,15 +100,160 @@ load_dotenv()
 # Default to SQLite if not specified, but allow MySQL via env var
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./symptom_checker.db")
 
-connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# Async driver for the same database: aiosqlite for SQLite, aiomysql for MySQL
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "mysql": "mysql+aiomysql", "mysql+pymysql": "mysql+aiomysql"}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# Connection pool tuning
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds; keep below MySQL wait_timeout
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+        # SQLAlchemy picks the SQLite pool itself (NullPool for aiosqlite, a
+        # singleton for :memory:); pool sizing applies to server databases
+        return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return options
+
+# Sync engine: schema management, migrations and scripts
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine: used by the API endpoints so queries never block the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Opt-in SQLite performance profile, applied to every new connection of both engines.
+# WAL lets history readers run alongside the writer; NORMAL sync is durable across
+# application crashes (only an OS crash can lose the last commits).
+SQLITE_PERFORMANCE_MODE = os.getenv("SQLITE_PERFORMANCE_MODE", "false").lower() == "true"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+if SQLITE_PERFORMANCE_MODE and SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
 def create_tables():
+    new_rollups = not inspect(engine).has_table(SymptomQueryRollup.__tablename__)
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    add_search_index()
+    if new_rollups:
+        rebuild_rollups()
+
+def rebuild_rollups():
+    """Recount every user's rollups from symptom_queries in one streamed pass."""
+    counts = Counter()
+    query = select(
+        SymptomQuery.user_id,
+        SymptomQuery.severity_estimate,
+        SymptomQuery.created_at,
+        # Rows that were never backfilled carry their severity only in the raw response
+        response_if_missing(SymptomQuery.severity_estimate),
+    )
+    with engine.begin() as conn:
+        for row in conn.execution_options(stream_results=True, yield_per=1000).execute(query):
+            severity = history_severity(row.severity_estimate, row.response)
+            for key in rollup_keys(row.user_id, severity, row.created_at or datetime.datetime.utcnow()):
+                counts[key] += 1
+        # Versions only ever grow: resetting them could make a stale ETag match again
+        conn.execute(delete(SymptomQueryRollup).where(SymptomQueryRollup.kind != "version"))
+        if counts:
+            conn.execute(
+                insert(SymptomQueryRollup),
+                [{"user_id": u, "kind": k, "bucket": b, "count": n} for (u, k, b), n in counts.items()],
+            )
+
+def add_missing_columns():
+    """Add columns introduced after a table was first created (create_all never alters)."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def add_missing_indexes():
+    """Create indexes declared on existing tables (create_all only indexes new tables)."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+# Full-text index over history symptoms and summaries (see search.py)
+SEARCH_FTS_TABLE = "symptom_queries_fts"
+MYSQL_FULLTEXT_INDEX = "ft_symptom_queries_text"
+
+# External-content FTS5 table: it stores only the index and reads text from
+# symptom_queries. Triggers keep it in sync with every insert, update and delete,
+# whichever code path (API, write-behind, migrations) makes the change.
+# user_id is indexed too, so the per-user filter is part of the MATCH.
+SQLITE_SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE {SEARCH_FTS_TABLE} USING fts5(
+        symptoms, summary, user_id,
+        content='symptom_queries', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS symptom_queries_fts_ai AFTER INSERT ON symptom_queries BEGIN
+        INSERT INTO {SEARCH_FTS_TABLE}(rowid, symptoms, summary, user_id)
+        VALUES (new.id, new.symptoms, new.summary, new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS symptom_queries_fts_ad AFTER DELETE ON symptom_queries BEGIN
+        INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, symptoms, summary, user_id)
+        VALUES ('delete', old.id, old.symptoms, old.summary, old.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS symptom_queries_fts_au AFTER UPDATE OF symptoms, summary, user_id ON symptom_queries BEGIN
+        INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, symptoms, summary, user_id)
+        VALUES ('delete', old.id, old.symptoms, old.summary, old.user_id);
+        INSERT INTO {SEARCH_FTS_TABLE}(rowid, symptoms, summary, user_id)
+        VALUES (new.id, new.symptoms, new.summary, new.user_id);
+    END""",
+    # Index the rows that existed before the FTS table
+    f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+def add_search_index():
+    """Create the full-text index for /history/search if it does not exist yet."""
+    inspector = inspect(engine)
+    if engine.dialect.name == "sqlite":
+        if inspector.has_table(SEARCH_FTS_TABLE):
+            return
+        with engine.begin() as conn:
+            for statement in SQLITE_SEARCH_DDL:
+                conn.execute(text(statement))
+    elif engine.dialect.name == "mysql":
+        existing = {i["name"] for i in inspector.get_indexes("symptom_queries")}
+        if MYSQL_FULLTEXT_INDEX not in existing:
+            # InnoDB maintains FULLTEXT indexes on every write
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE symptom_queries ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (symptoms, summary)"))
 
 def get_db():
     db = SessionLocal()
@@ -48,3 +261,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,158 @@
+import os
+import re
+
+# Prompt configuration.
+# "legacy": the full rules and JSON template are sent inline with every request.
+# "structured": the rules live in the model's system_instruction, the JSON shape is
+#   enforced with response_schema, and only the (normalized) symptoms are sent.
+PROMPT_MODE = os.getenv("PROMPT_MODE", "legacy")
+MAX_SYMPTOM_CHARS = int(os.getenv("MAX_SYMPTOM_CHARS", 2000))
+
+SYSTEM_INSTRUCTION = """You are an AI Healthcare Symptom Checker for informational and educational purposes only. You are NOT a medical professional.
+
+Analyze the user's symptoms and fill every field of the response schema:
+- summary: the symptoms rewritten in simple, clear language.
+- possible_common_causes: 2-5 possible common causes, phrased tentatively ("This may be related to...", "Sometimes symptoms like this are associated with..."). Never a definitive diagnosis.
+- severity_estimate: exactly one of "Low Concern", "Moderate Concern", "High Concern", based on impact on daily activities.
+- self_care_tips: only safe, general, non-medical advice (rest, warm compress, gentle stretching, hydration, ergonomic posture). No medication, prescriptions or exercises that could worsen injury.
+- red_flags: 3-6 warning signs relevant to the symptoms that mean the user should seek medical care.
+- consultation_timing: a general timeframe for seeing a professional (e.g. symptoms lasting more than a few days, interfering with daily life, or suddenly worsening).
+- disclaimer: exactly "This response is for educational purposes only and is not a medical diagnosis or professional medical advice. If you are worried about your symptoms or they worsen, please consult a licensed healthcare professional."
+
+Rules: never claim certainty; never mention medications, side effects, dosages or treatment steps; never ask for personal information; keep a calm, helpful, non-alarming tone. If the symptoms match any emergency pattern, set severity_estimate to "High Concern" and politely encourage urgent professional help."""
+
+# Mirrors StructuredSymptomResponse; every field is required so the model cannot omit one
+_TEXT = {"type": "string"}
+_TEXT_LIST = {"type": "array", "items": {"type": "string"}}
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": _TEXT,
+        "possible_common_causes": _TEXT_LIST,
+        "severity_estimate": {"type": "string", "format": "enum", "enum": ["Low Concern", "Moderate Concern", "High Concern"]},
+        "self_care_tips": _TEXT_LIST,
+        "red_flags": _TEXT_LIST,
+        "consultation_timing": _TEXT,
+        "disclaimer": _TEXT,
+    },
+    "required": [
+        "summary",
+        "possible_common_causes",
+        "severity_estimate",
+        "self_care_tips",
+        "red_flags",
+        "consultation_timing",
+        "disclaimer",
+    ],
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def clean_symptoms(text: str) -> str:
+    """Collapse whitespace and cap length so one oversized input cannot inflate the prompt."""
+    text = _WHITESPACE.sub(" ", text).strip()
+    if len(text) > MAX_SYMPTOM_CHARS:
+        text = text[:MAX_SYMPTOM_CHARS].rsplit(" ", 1)[0] + " ..."
+    return text
+
+
+def build_structured_prompt(symptoms: str) -> str:
+    return f"Symptoms: {clean_symptoms(symptoms)}"
+
+
+def build_legacy_prompt(symptoms: str) -> str:
+    return f"""
+    You are an AI-powered Healthcare Symptom Checker designed for informational and educational purposes only.
+    You are NOT a medical professional, and you must NEVER provide a diagnosis, medication names, or treatment dosage.
+
+    Your role is to analyze the user's symptoms: "{symptoms}"
+    
+    Provide possible common explanations, supportive guidance, and safe recommendations while maintaining a responsible tone.
+
+    Every response must ALWAYS follow the exact structure below, regardless of the input:
+
+    ----------------------------------------------------
+    RESPONSE TEMPLATE (STRICT FORMAT):
+
+    📝 Summary:
+    Rewrite the user’s symptoms in simple, clear language.
+
+    🔍 Possible Common Causes (not a diagnosis):
+    List 2–5 possible common causes. Use phrasing like:
+    - "This may be related to..."
+    - "Sometimes symptoms like this are associated with..."
+    Do NOT sound certain. Avoid any definitive diagnosis.
+
+    🎯 Severity Estimate:
+    Classify as one of the following, based on impact on daily activities:
+    - Low Concern
+    - Moderate Concern
+    - High Concern
+
+    💡 Helpful Self-Care Tips:
+    Suggest only safe, general, non-medical advice such as:
+    - Rest
+    - Warm compress
+    - Gentle stretching
+    - Good hydration
+    - Ergonomic posture
+    Avoid medication, prescriptions, or exercises that could worsen injury.
+
+    🚩 Seek Medical Care If You Notice:
+    Provide 3–6 red flag warnings relevant to symptoms.
+    Examples:
+    - Numbness or weakness
+    - Difficulty breathing
+    - Severe or worsening pain
+    - Loss of bladder/bowel control
+
+    📅 When to Consider Consultation:
+    Give a general timeframe such as:
+    - If symptoms last more than a few days
+    - If symptoms interfere with walking or daily life
+    - If symptoms suddenly worsen
+
+    ⚠️ Disclaimer (MANDATORY):
+    “This response is for educational purposes only and is not a medical diagnosis or professional medical advice. If you are worried about your symptoms or they worsen, please consult a licensed healthcare professional.”
+    ----------------------------------------------------
+
+    ADDITIONAL RULES:
+    - NEVER claim certainty.
+    - NEVER mention medications, side effects, or treatment steps.
+    - NEVER ask for personal information.
+    - Maintain a calm, helpful, and non-alarming tone.
+    - If symptoms indicate any emergency pattern, classify severity as HIGH and politely encourage urgent professional help.
+
+    Return the response as a valid JSON object matching this structure:
+    {{
+        "summary": "...",
+        "possible_common_causes": ["...", "..."],
+        "severity_estimate": "...",
+        "self_care_tips": ["...", "..."],
+        "red_flags": ["...", "..."],
+        "consultation_timing": "...",
+        "disclaimer": "..."
+    }}
+    """
+
+def build_prompt(symptoms: str) -> str:
+    if PROMPT_MODE == "structured":
+        return build_structured_prompt(symptoms)
+    return build_legacy_prompt(symptoms)
+
+
+def extract_json(text: str) -> str:
+    # Clean up potential markdown code blocks
+    if "```json" in text:
+        return text.split("```json")[1].split("```")[0].strip()
+    if "```" in text:
+        return text.split("```")[1].split("```")[0].strip()
+    return text
+
+
+def parse_response_text(text: str) -> str:
+    """Return the JSON document in an LLM answer. Structured mode returns bare JSON."""
+    if PROMPT_MODE == "structured":
+        return text.strip()
+    return extract_json(text)
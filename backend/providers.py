@@ -0,0 +1,394 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+
+from llm import FakeModel, JSONSectionParser, build_model, llm_gate
+from metrics import Counter, Histogram, llm_prompt_bytes, llm_response_bytes, stage_duration
+from prompts import PROMPT_MODE, RESPONSE_SCHEMA, build_legacy_prompt, build_prompt, clean_symptoms, extract_json, parse_response_text
+from resilience import LLM_ATTEMPT_TIMEOUT_SECONDS, LLM_DEADLINE_SECONDS, CircuitBreaker, CircuitOpen, MalformedResponse, call_with_retries, is_transient, llm_retries
+
+# Provider order: the first is the primary, the rest are hedge/fallback targets.
+# "gemini" (uses LLM_BACKEND), "groq" (needs GROQ_API_KEY) and "stub" (offline FakeModel).
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", "gemini").split(",") if name.strip()]
+GROQ_MODEL_NAME = os.getenv("GROQ_MODEL_NAME", "llama-3.3-70b-versatile")
+
+# Hedging: start the next provider once the current one has been slower than
+# this percentile of its own recent latencies.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_DEFAULT_DELAY_MS = int(os.getenv("LLM_HEDGE_DEFAULT_DELAY_MS", 5000))
+LATENCY_WINDOW = 200
+
+provider_latency = Histogram("llm_provider_latency_seconds", "LLM latency by provider", ("provider",))
+provider_errors = Counter("llm_provider_errors_total", "Failed or invalid LLM answers by provider", ("provider",))
+hedged_requests = Counter("llm_hedged_requests_total", "Hedge requests started, by hedge provider", ("provider",))
+router_wins = Counter("llm_router_wins_total", "Answers used, by provider", ("provider",))
+
+
+class LLMUnavailable(Exception):
+    """No provider produced an answer. `retry_after` is set when every circuit was open."""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceeded(LLMUnavailable):
+    status_code = 504
+
+
+def generation_config():
+    import google.generativeai as genai  # already loaded by build_model(); kept off the import path
+
+    if PROMPT_MODE == "structured":
+        return genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=RESPONSE_SCHEMA,
+        )
+    return genai.types.GenerationConfig(response_mime_type="application/json")
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LLMProvider:
+    """Turns symptoms into the raw JSON text of a StructuredSymptomResponse."""
+
+    name = ""
+    # Providers that can stream their answer implement stream(symptoms), yielding text chunks
+    streams = False
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(self.name)
+        self.errors = 0
+
+    async def complete(self, symptoms: str) -> str:
+        raise NotImplementedError
+
+    async def generate(self, symptoms: str) -> str:
+        start = time.perf_counter()
+        try:
+            text = await self.complete(symptoms)
+        except Exception:
+            self.errors += 1
+            provider_errors.inc(provider=self.name)
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        provider_latency.observe(elapsed, provider=self.name)
+        return text
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "samples": len(self.latency.samples),
+            "p50_ms": _ms(self.latency.percentile(50)),
+            "p95_ms": _ms(self.latency.percentile(95)),
+            "errors": self.errors,
+            "circuit": self.breaker.stats(),
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+    streams = True
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    async def complete(self, symptoms):
+        with stage_duration.time(stage="prompt"):
+            prompt = build_prompt(symptoms)
+        llm_prompt_bytes.observe(len(prompt.encode()))
+        response = await llm_gate.generate(self.model, prompt, generation_config=generation_config())
+        llm_response_bytes.observe(len(response.text.encode()))
+        return parse_response_text(response.text)
+
+    async def stream(self, symptoms):
+        prompt = build_prompt(symptoms)
+        llm_prompt_bytes.observe(len(prompt.encode()))
+        async for chunk in llm_gate.stream(self.model, prompt, generation_config=generation_config()):
+            yield chunk
+
+
+class GroqProvider(LLMProvider):
+    """Groq chat completions in JSON mode, driven by the legacy prompt (which carries the JSON template)."""
+
+    name = "groq"
+
+    def __init__(self, api_key, model_name=GROQ_MODEL_NAME):
+        super().__init__()
+        from groq import Groq
+
+        self.client = Groq(api_key=api_key)
+        self.model_name = model_name
+
+    async def complete(self, symptoms):
+        prompt = build_legacy_prompt(clean_symptoms(symptoms))
+        llm_prompt_bytes.observe(len(prompt.encode()))
+        completion = await llm_gate.call(
+            self.client.chat.completions.create,
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+        )
+        text = completion.choices[0].message.content
+        llm_response_bytes.observe(len(text.encode()))
+        return extract_json(text)
+
+
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def __init__(self, model=None):
+        super().__init__()
+        self.model = model or FakeModel()
+
+    async def complete(self, symptoms):
+        response = await llm_gate.generate(self.model, symptoms)
+        return response.text
+
+
+class LLMRouter:
+    """Sends each request to the primary provider, hedging and falling back to the others.
+
+    If no valid answer has arrived after the current provider's recent
+    LLM_HEDGE_PERCENTILE latency, the next provider is started as well and the
+    first valid answer wins. Each provider retries its own transient errors
+    and malformed answers; once those are exhausted (or its circuit is open)
+    the next provider takes over. The whole request is bounded by
+    LLM_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, providers, parse):
+        self.providers = providers
+        self.parse = parse
+
+    def hedge_delay(self, provider):
+        if len(provider.latency.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY_MS / 1000
+        return provider.latency.percentile(LLM_HEDGE_PERCENTILE)
+
+    async def _attempt(self, provider, symptoms):
+        async def once():
+            text = await provider.generate(symptoms)
+            try:
+                return self.parse(text)
+            except Exception as e:
+                provider.errors += 1
+                provider_errors.inc(provider=provider.name)
+                raise MalformedResponse(str(e)) from e
+
+        return await call_with_retries(provider.name, once, provider.breaker)
+
+    def retry_after(self):
+        """Seconds until some provider's circuit lets a call through again (0 when one would now)."""
+        return min((provider.breaker.retry_after() for provider in self.providers), default=0)
+
+    async def generate(self, symptoms: str, deadline=None):
+        """Returns (provider name, raw JSON, parsed response) from the first provider with a valid answer.
+
+        `deadline` (event loop time) defaults to LLM_DEADLINE_SECONDS from now.
+        """
+        if not self.providers:
+            raise LLMUnavailable("No LLM providers configured")
+        remaining = list(self.providers)
+        pending = {}
+        errors = []
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + LLM_DEADLINE_SECONDS
+
+        def launch():
+            provider = remaining.pop(0)
+            pending[asyncio.ensure_future(self._attempt(provider, symptoms))] = provider
+            return provider
+
+        current = launch()
+        try:
+            while pending:
+                time_left = deadline - loop.time()
+                timeout = min(self.hedge_delay(current), time_left) if remaining else time_left
+                done, _ = await asyncio.wait(pending, timeout=max(0, timeout), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if not remaining or loop.time() >= deadline:
+                        raise LLMDeadlineExceeded(f"No LLM answer within {LLM_DEADLINE_SECONDS:g}s")
+                    hedged_requests.inc(provider=remaining[0].name)
+                    current = launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        response_content, response_obj = task.result()
+                    except Exception as e:
+                        errors.append((provider.name, e))
+                        continue
+                    router_wins.inc(provider=provider.name)
+                    return provider.name, response_content, response_obj
+                if not pending and remaining:
+                    current = launch()
+            message = "All LLM providers failed: " + "; ".join(f"{name}: {str(e) or type(e).__name__}" for name, e in errors)
+            if errors and all(isinstance(e, CircuitOpen) for _, e in errors):
+                raise LLMUnavailable(message, retry_after=min(e.retry_after for _, e in errors))
+            raise LLMUnavailable(message)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, symptoms: str):
+        """Yield ("section", (key, value)) for each top-level field of the answer, then ("answer", generate()'s tuple).
+
+        The primary provider streams its fields as they arrive when it can
+        stream and its circuit lets the call through; the stream counts as one
+        attempt on that circuit and is cut off after LLM_ATTEMPT_TIMEOUT_SECONDS.
+        Otherwise, or when the stream fails before its first field, the answer
+        comes from generate() (retries, fallback and hedging included) and its
+        fields are yielded once it is complete. The whole request is bounded
+        by LLM_DEADLINE_SECONDS.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LLM_DEADLINE_SECONDS
+        primary = self.providers[0] if self.providers else None
+        if primary is not None and primary.streams:
+            streamed = False
+            try:
+                stop_at = min(deadline, loop.time() + LLM_ATTEMPT_TIMEOUT_SECONDS)
+                async with aclosing(self._stream_attempt(primary, symptoms, stop_at)) as attempt:
+                    async for item in attempt:
+                        streamed = streamed or item[0] == "section"
+                        yield item
+                return
+            except CircuitOpen:
+                pass
+            except Exception as e:
+                # Fields already sent cannot be taken back; before that, the answer can still come from generate()
+                if streamed or not is_transient(e):
+                    raise
+                llm_retries.inc(provider=primary.name, reason="stream")
+
+        answer = await self.generate(symptoms, deadline)
+        for key, value in json.loads(answer[1]).items():
+            yield "section", (key, value)
+        yield "answer", answer
+
+    async def _stream_attempt(self, provider, symptoms, stop_at):
+        provider.breaker.before_call()
+        loop = asyncio.get_running_loop()
+        parser = JSONSectionParser()
+        chunks = provider.stream(symptoms)
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), timeout=max(0, stop_at - loop.time()))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise asyncio.TimeoutError(f"{provider.name} stream did not finish in time")
+                for key, value in parser.feed(chunk):
+                    yield "section", (key, value)
+            llm_response_bytes.observe(len(parser.buffer.encode()))
+            try:
+                response_content, response_obj = self.parse(parse_response_text(parser.buffer))
+            except Exception as e:
+                raise MalformedResponse(str(e)) from e
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away: no outcome to record
+            provider.breaker.release_probe()
+            raise
+        except Exception:
+            provider.breaker.record(False)
+            provider.errors += 1
+            provider_errors.inc(provider=provider.name)
+            raise
+        finally:
+            await chunks.aclose()
+        provider.breaker.record(True)
+        elapsed = time.perf_counter() - start
+        provider.latency.record(elapsed)
+        provider_latency.observe(elapsed, provider=provider.name)
+        router_wins.inc(provider=provider.name)
+        yield "answer", (provider.name, response_content, response_obj)
+
+    def stats(self):
+        return [provider.stats() for provider in self.providers]
+
+
+def build_providers(model, names=LLM_PROVIDERS):
+    providers = []
+    for name in names:
+        if name == "gemini":
+            if model is not None:
+                providers.append(GeminiProvider(model))
+        elif name == "groq":
+            api_key = os.getenv("GROQ_API_KEY")
+            if api_key:
+                providers.append(GroqProvider(api_key))
+        elif name == "stub":
+            providers.append(StubProvider())
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+    return providers
+
+
+class LLMClients:
+    """The model and router, built on first use in each worker process.
+
+    Importing and configuring the SDK dominates startup, so it is kept off the
+    import path: workers start serving at once and `get()` (or an early
+    `warm_up()`) builds the clients in a thread, never on the event loop.
+    """
+
+    def __init__(self, parse):
+        self.parse = parse
+        self._lock = threading.Lock()
+        self._clients = None
+
+    @property
+    def ready(self):
+        return self._clients is not None
+
+    def _build(self):
+        with self._lock:
+            if self._clients is None:
+                model = build_model()
+                self._clients = (model, LLMRouter(build_providers(model), self.parse))
+        return self._clients
+
+    async def get(self):
+        """Returns (model, router)."""
+        if self._clients is not None:
+            return self._clients
+        return await asyncio.to_thread(self._build)
+
+    async def warm_up(self):
+        try:
+            await self.get()
+        except Exception as e:
+            # get() raises again on the first request that needs the clients
+            print(f"LLM client initialization failed: {e}")
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter
+
+# Per-user token buckets for the LLM-backed endpoints: RATE_LIMIT_BURST requests
+# at once, refilled at RATE_LIMIT_PER_MINUTE. "memory" keeps buckets per worker;
+# "sqlite" shares them between the workers on one host.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory", "sqlite" or "none"
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 10))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 5))
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "./rate_limits.db")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# How long a check waits for another worker's lock on the SQLite bucket table before
+# giving up and admitting the request (a limiter outage must not become an API outage)
+RATE_LIMIT_SQLITE_TIMEOUT_MS = int(os.getenv("RATE_LIMIT_SQLITE_TIMEOUT_MS", 250))
+
+admission_rejections = Counter("admission_rejections_total", "LLM requests refused before any work, by reason", ("reason",))
+rate_limit_errors = Counter("rate_limit_errors_total", "Rate limit checks that failed and admitted the request")
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def spend(tokens, cost, rate, burst):
+    """Returns (tokens left, seconds to wait). A cost above the burst needs a full
+    bucket and leaves it in debt, so large batches are admitted but paid for."""
+    needed = min(cost, burst)
+    if tokens < needed:
+        return tokens, (needed - tokens) / rate
+    return tokens - cost, 0.0
+
+
+class MemoryRateLimitStore:
+    """Token buckets in an in-process LRU dict (least recently seen users are dropped first)."""
+
+    blocking = False
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Remove `cost` tokens from the bucket; returns 0 on success, else seconds until they are available."""
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            tokens, wait = spend(tokens, cost, rate, burst)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteRateLimitStore:
+    """Token buckets in a SQLite table, so every worker on the host draws from the same bucket."""
+
+    # take() may wait on another process's write lock, so it is run off the event loop
+    blocking = True
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH, timeout_ms=RATE_LIMIT_SQLITE_TIMEOUT_MS):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout_ms / 1000)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def take(self, key, cost, rate, burst):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, making read-modify-write atomic across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = refill(row[0], row[1], now, rate, burst) if row else burst
+                tokens, wait = spend(tokens, cost, rate, burst)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return wait
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """Token-bucket limiter keyed on user id; a request costs one token per LLM analysis."""
+
+    def __init__(self, store, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.store = store
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    async def check(self, user_id, cost=1):
+        """Returns 0 when the request is admitted, else the seconds to wait before retrying.
+
+        Fails open: if the store cannot be read (e.g. the SQLite table stays
+        locked past its timeout), the request is admitted.
+        """
+        if self.store is None:
+            return 0
+        args = (f"user:{user_id}", cost, self.rate, self.burst)
+        try:
+            if self.store.blocking:
+                wait = await asyncio.to_thread(self.store.take, *args)
+            else:
+                wait = self.store.take(*args)
+        except sqlite3.Error as e:
+            print(f"Rate limit check failed, admitting request: {e}")
+            self.errors += 1
+            rate_limit_errors.inc()
+            return 0
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self):
+        return {
+            "backend": RATE_LIMIT_BACKEND,
+            "per_minute": self.rate * 60,
+            "burst": self.burst,
+            "buckets": len(self.store) if self.store is not None else 0,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+
+
+def build_rate_limit_store(name=RATE_LIMIT_BACKEND):
+    if name == "memory":
+        return MemoryRateLimitStore()
+    if name == "sqlite":
+        return SQLiteRateLimitStore()
+    return None
+
+
+rate_limiter = RateLimiter(build_rate_limit_store())
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+from metrics import Counter, Gauge
+
+# Deadlines: each provider attempt is cut off after LLM_ATTEMPT_TIMEOUT_SECONDS,
+# and a whole request (hedges and retries included) after LLM_DEADLINE_SECONDS
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", 20))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 45))
+
+# Retries for transient errors and malformed JSON, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_MS = int(os.getenv("LLM_RETRY_BASE_MS", 250))
+LLM_RETRY_MAX_MS = int(os.getenv("LLM_RETRY_MAX_MS", 4000))
+
+# Circuit breaker: opens when at least LLM_BREAKER_MIN_CALLS calls in the last
+# LLM_BREAKER_WINDOW_SECONDS failed at LLM_BREAKER_FAILURE_RATE or more
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", 0.5))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", 10))
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", 60))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", 30))
+
+# HTTP-style codes that providers use for overload and temporary outages
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = Gauge("llm_circuit_state", "Circuit breaker state by provider (0 closed, 1 half-open, 2 open)", ("provider",))
+breaker_rejections = Counter("llm_circuit_rejections_total", "Calls refused by an open circuit, by provider", ("provider",))
+llm_retries = Counter("llm_retries_total", "LLM attempts retried, by provider and reason", ("provider", "reason"))
+
+
+class MalformedResponse(Exception):
+    """The provider answered, but not with a valid StructuredSymptomResponse."""
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit open for {name}; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_transient(exc):
+    """Errors worth retrying: timeouts, connection problems, overload and malformed answers."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError, MalformedResponse)):
+        return True
+    # google.api_core errors carry `code`, groq's APIStatusError carries `status_code`
+    code = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+        return True
+    # groq.APIConnectionError / APITimeoutError
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def backoff_delay(attempt, base_ms=LLM_RETRY_BASE_MS, max_ms=LLM_RETRY_MAX_MS):
+    """Full jitter: uniform over [0, min(max, base * 2**attempt)] so retries from many requests spread out."""
+    return random.uniform(0, min(max_ms, base_ms * 2 ** attempt)) / 1000
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over a sliding time window.
+
+    closed: calls pass and outcomes are recorded. open: calls are refused
+    until the cooldown has passed. half_open: a single probe call is let
+    through; its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, name, failure_rate=LLM_BREAKER_FAILURE_RATE, min_calls=LLM_BREAKER_MIN_CALLS,
+                 window_seconds=LLM_BREAKER_WINDOW_SECONDS, cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.outcomes = deque()  # (monotonic time, ok)
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        breaker_state.set(STATE_VALUES[state], provider=self.name)
+
+    def _prune(self, now):
+        while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+            self.outcomes.popleft()
+
+    def retry_after(self):
+        if self.state != OPEN:
+            return 0
+        return max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """Raise CircuitOpen if the call may not proceed."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                breaker_rejections.inc(provider=self.name)
+                raise CircuitOpen(self.name, self.retry_after())
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probe_in_flight:
+                breaker_rejections.inc(provider=self.name)
+                raise CircuitOpen(self.name, 1)
+            self.probe_in_flight = True
+
+    def record(self, ok):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+            if ok:
+                self.outcomes.clear()
+                self._set_state(CLOSED)
+            else:
+                self._open(now)
+            return
+        self.outcomes.append((now, ok))
+        self._prune(now)
+        failures = sum(1 for _, success in self.outcomes if not success)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+            self._open(now)
+
+    def release_probe(self):
+        """The half-open probe ended without an outcome (e.g. it was cancelled)."""
+        self.probe_in_flight = False
+
+    def _open(self, now):
+        self.opened_at = now
+        self.outcomes.clear()
+        self._set_state(OPEN)
+
+    def stats(self):
+        self._prune(time.monotonic())
+        return {
+            "state": self.state,
+            "recent_calls": len(self.outcomes),
+            "recent_failures": sum(1 for _, ok in self.outcomes if not ok),
+            "retry_after_s": round(self.retry_after(), 1),
+        }
+
+
+async def call_with_retries(name, fn, breaker, max_retries=LLM_MAX_RETRIES, timeout=LLM_ATTEMPT_TIMEOUT_SECONDS):
+    """Await `fn()` under the breaker, with a per-attempt timeout and jittered retries of transient errors."""
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(fn(), timeout=timeout)
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            breaker.record(False)
+            if attempt >= max_retries or not is_transient(e):
+                raise
+            reason = "malformed" if isinstance(e, MalformedResponse) else "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            llm_retries.inc(provider=name, reason=reason)
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        breaker.record(True)
+        return result
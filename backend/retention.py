@@ -0,0 +1,310 @@
+"""Bulk deletion of symptom history: the retention purge and /history/bulk_delete.
+
+Rows are deleted in batches of RETENTION_BATCH_SIZE, oldest first, each in
+its own short transaction with a pause in between, so a large purge never
+holds a long write lock on symptom_queries. Rollups are decremented in the
+same transaction as each batch; the FTS index follows via its delete trigger.
+The purge runs in the background when RETENTION_DAYS > 0 (in one worker
+process per host, see RETENTION_LOCK_PATH), or once from the command line:
+
+    python retention.py --days 365 --dry-run
+    python retention.py --days 365
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import time
+from collections import Counter as DeltaCounter
+
+from sqlalchemy import delete, func, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, a single process is assumed
+    fcntl = None
+
+from metrics import Counter, Gauge, Histogram
+from models import AsyncSessionLocal, SymptomQuery, async_engine, history_severity, response_if_missing, rollup_keys
+from rollups import apply_rollup_deltas
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 0))  # 0 disables the background purge
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 1000))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", 3600))
+RETENTION_PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", 50))  # between batches, so other writers get the lock
+RETENTION_DRY_RUN = os.getenv("RETENTION_DRY_RUN", "false").lower() == "true"
+# Every worker starts a purger, but only the one holding this file lock runs it;
+# another worker takes over within one interval if that process exits
+RETENTION_LOCK_PATH = os.getenv("RETENTION_LOCK_PATH", "./retention.lock")
+
+deleted_rows = Counter("history_deleted_rows_total", "History rows removed by bulk deletes", ("source",))
+delete_batches_total = Counter("history_delete_batches_total", "Bulk delete batches committed", ("source",))
+delete_batch_duration = Histogram("history_delete_batch_seconds", "Duration of one bulk delete batch", ("source",))
+
+
+async def count_matching(session_factory, conditions) -> int:
+    async with session_factory() as db:
+        return (await db.execute(select(func.count()).select_from(SymptomQuery).where(*conditions))).scalar_one()
+
+
+async def delete_batches(session_factory, conditions, source, batch_size=RETENTION_BATCH_SIZE, pause_ms=RETENTION_PAUSE_MS):
+    """Delete rows matching `conditions`, oldest first; yields the size of each committed batch.
+
+    Stop early by breaking out of the loop: no session or transaction is held
+    while a batch count is being yielded.
+    """
+    query = (
+        select(
+            SymptomQuery.id,
+            SymptomQuery.user_id,
+            SymptomQuery.created_at,
+            SymptomQuery.severity_estimate,
+            # Rows that were never backfilled carry their severity only in the raw response
+            response_if_missing(SymptomQuery.severity_estimate),
+        )
+        .where(*conditions)
+        .order_by(SymptomQuery.created_at, SymptomQuery.id)
+        .limit(batch_size)
+    )
+    first = True
+    while True:
+        if not first:
+            await asyncio.sleep(pause_ms / 1000)
+        first = False
+        start = time.perf_counter()
+        async with session_factory() as db:
+            rows = (await db.execute(query)).all()
+            if not rows:
+                return
+            result = await db.execute(
+                delete(SymptomQuery)
+                .where(SymptomQuery.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != len(rows):
+                # A concurrent delete got some of these rows first; recount from scratch
+                await db.rollback()
+                continue
+            # Bulk statements bypass the after_flush rollup hook
+            deltas = DeltaCounter()
+            for row in rows:
+                severity = history_severity(row.severity_estimate, row.response)
+                for key in rollup_keys(row.user_id, severity, row.created_at or datetime.datetime.utcnow()):
+                    deltas[key] -= 1
+            await db.run_sync(lambda session: apply_rollup_deltas(session.connection(), deltas))
+            await db.commit()
+        delete_batch_duration.observe(time.perf_counter() - start, source=source)
+        delete_batches_total.inc(source=source)
+        deleted_rows.inc(len(rows), source=source)
+        yield len(rows)
+
+
+def retention_conditions(days, now=None):
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=days)
+    return [SymptomQuery.created_at < cutoff]
+
+
+class LeaderLock:
+    """Non-blocking exclusive lock on a file, held until release() or process exit.
+
+    Elects one process among the workers sharing a host (and a lock path).
+    """
+
+    def __init__(self, path=RETENTION_LOCK_PATH):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None or fcntl is None
+
+    def acquire(self):
+        """True if this process holds the lock (now or already)."""
+        if self.held:
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class RetentionPurger:
+    """Periodically deletes history older than `days`, in batches, from one background task.
+
+    With several workers, only the one holding `leader_lock` purges; the
+    others check again every interval.
+    """
+
+    def __init__(self, days=RETENTION_DAYS, interval_seconds=RETENTION_INTERVAL_SECONDS,
+                 batch_size=RETENTION_BATCH_SIZE, pause_ms=RETENTION_PAUSE_MS, dry_run=RETENTION_DRY_RUN,
+                 session_factory=AsyncSessionLocal, leader_lock=None):
+        self.leader_lock = leader_lock or LeaderLock()
+        self.days = days
+        self.interval = interval_seconds
+        self.batch_size = batch_size
+        self.pause_ms = pause_ms
+        self.dry_run = dry_run
+        self.session_factory = session_factory
+        self._task = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.runs = 0
+        self.failed_runs = 0
+        self.last_run = None
+        self.current = None
+
+    @property
+    def enabled(self):
+        return self._task is not None
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    @property
+    def remaining(self):
+        """Rows the current run still has to delete (0 when idle)."""
+        if self.current is None or self.current["dry_run"]:
+            return 0
+        return max(self.current["eligible"] - self.current["deleted"], 0)
+
+    def start(self):
+        if self._task is None and self.days > 0:
+            self._stopping = False
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the background task; a run in progress stops after its current batch."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self.leader_lock.release()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if self.leader_lock.acquire():
+                    await self.run_once()
+            except Exception as e:
+                print(f"Retention purge error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_once(self, dry_run=None, days=None):
+        """Purge (or with dry_run, only count) rows older than the retention age; returns the run summary."""
+        days = days or self.days
+        if days <= 0:
+            raise ValueError("Retention age must be a positive number of days")
+        if self._lock.locked():
+            raise RuntimeError("A retention purge is already running")
+        async with self._lock:
+            return await self._purge(self.dry_run if dry_run is None else dry_run, days)
+
+    async def _purge(self, dry_run, days):
+        conditions = retention_conditions(days)
+        self.current = run = {
+            "dry_run": dry_run,
+            "days": days,
+            "started_at": datetime.datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "eligible": 0,
+            "deleted": 0,
+            "batches": 0,
+            "error": None,
+        }
+        try:
+            run["eligible"] = await count_matching(self.session_factory, conditions)
+            if not dry_run and run["eligible"]:
+                async for count in delete_batches(
+                    self.session_factory, conditions, "retention", self.batch_size, self.pause_ms
+                ):
+                    run["deleted"] += count
+                    run["batches"] += 1
+                    if self._stopping:
+                        break
+        except Exception as e:
+            self.failed_runs += 1
+            run["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            run["finished_at"] = datetime.datetime.utcnow().isoformat()
+            self.runs += 1
+            self.last_run = run
+            self.current = None
+        return run
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "leader": self.enabled and self.leader_lock.held,
+            "days": self.days,
+            "dry_run": self.dry_run,
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval,
+            "running": self.running,
+            "current_run": self.current,
+            "last_run": self.last_run,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+        }
+
+
+retention_purger = RetentionPurger()
+
+Gauge("retention_purge_running", "1 while a retention purge is in progress",
+      fn=lambda: int(retention_purger.running))
+Gauge("retention_purge_remaining_rows", "Rows the running retention purge has yet to delete",
+      fn=lambda: retention_purger.remaining)
+Gauge("retention_last_eligible_rows", "Rows older than the retention age at the start of the last run",
+      fn=lambda: (retention_purger.current or retention_purger.last_run or {}).get("eligible", 0))
+
+
+async def _main(args):
+    purger = RetentionPurger(days=args.days, batch_size=args.batch_size, pause_ms=args.pause_ms)
+    task = asyncio.ensure_future(purger.run_once(dry_run=args.dry_run))
+    while not task.done():
+        await asyncio.sleep(1)
+        current = purger.current
+        if current and not current["dry_run"] and current["eligible"]:
+            print(f"  {current['deleted']}/{current['eligible']} rows deleted", flush=True)
+    run = task.result()
+    await async_engine.dispose()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="Delete history older than this many days")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be deleted")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=RETENTION_PAUSE_MS)
+    args = parser.parse_args()
+    if args.days <= 0:
+        parser.error("--days (or RETENTION_DAYS) must be positive")
+
+    run = asyncio.run(_main(args))
+    if run["dry_run"]:
+        print(f"{run['eligible']} rows older than {run['days']} days would be deleted")
+    else:
+        print(f"Deleted {run['deleted']} of {run['eligible']} rows older than {run['days']} days in {run['batches']} batches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import datetime
+from collections import Counter
+
+from sqlalchemy import delete, event, or_, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+from models import SymptomQuery, SymptomQueryRollup, history_severity, rollup_keys, week_bucket
+
+# Incremental maintenance of symptom_query_rollups. Every ORM flush that adds or
+# deletes SymptomQuery rows (API requests, write-behind batches, deletes) applies
+# the matching +1/-1 deltas in the same transaction, so the counts cannot drift
+# from the history they summarize. Bulk statements that bypass the ORM unit of
+# work must call apply_rollup_deltas themselves.
+#
+# Each user also has a "version" rollup that grows with every change to their
+# history; it is the ETag of the history endpoints.
+
+
+def upsert_rollups(conn, rows):
+    """Add each row's count to its rollup, creating missing rollups."""
+    table = SymptomQueryRollup.__table__
+    if conn.dialect.name == "sqlite":
+        stmt = sqlite.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.kind, table.c.bucket],
+            set_={"count": table.c.count + stmt.excluded["count"]},
+        )
+        conn.execute(stmt, rows)
+    elif conn.dialect.name == "mysql":
+        stmt = mysql.insert(table)
+        conn.execute(stmt.on_duplicate_key_update(count=table.c.count + stmt.inserted["count"]), rows)
+    else:
+        for row in rows:
+            result = conn.execute(
+                update(table)
+                .where(table.c.user_id == row["user_id"], table.c.kind == row["kind"], table.c.bucket == row["bucket"])
+                .values(count=table.c.count + row["count"])
+            )
+            if result.rowcount == 0:
+                conn.execute(table.insert().values(**row))
+
+
+def apply_rollup_deltas(conn, deltas: Counter):
+    """Apply {(user_id, kind, bucket): delta} and drop rollups that reached zero."""
+    rows = [{"user_id": u, "kind": k, "bucket": b, "count": n} for (u, k, b), n in deltas.items() if n]
+    if not rows:
+        return
+    rows += [{"user_id": u, "kind": "version", "bucket": "", "count": 1} for u in {row["user_id"] for row in rows}]
+    upsert_rollups(conn, rows)
+    table = SymptomQueryRollup.__table__
+    if any(row["count"] < 0 for row in rows):
+        users = {row["user_id"] for row in rows}
+        conn.execute(delete(table).where(table.c.user_id.in_(users), table.c.count <= 0))
+
+
+@event.listens_for(Session, "after_flush")
+def _update_rollups(session, flush_context):
+    # new/deleted still describe what this flush just wrote
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, SymptomQuery):
+            for key in rollup_keys(obj.user_id, obj.severity_estimate, obj.created_at):
+                deltas[key] += 1
+    for obj in session.deleted:
+        if isinstance(obj, SymptomQuery):
+            for key in rollup_keys(obj.user_id, history_severity(obj.severity_estimate, obj.response), obj.created_at):
+                deltas[key] -= 1
+    if deltas:
+        apply_rollup_deltas(session.connection(), deltas)
+
+
+def history_version_query(user_id: int):
+    """The user's history version: a primary-key lookup (no row means 0)."""
+    return select(SymptomQueryRollup.count).where(
+        SymptomQueryRollup.user_id == user_id,
+        SymptomQueryRollup.kind == "version",
+        SymptomQueryRollup.bucket == "",
+    )
+
+
+def stats_query(user_id: int, weeks: int):
+    """Rollup rows for the /stats payload: every severity, and the last `weeks` weeks."""
+    first_week = week_bucket(datetime.datetime.utcnow() - datetime.timedelta(weeks=weeks - 1))
+    return select(SymptomQueryRollup.kind, SymptomQueryRollup.bucket, SymptomQueryRollup.count).where(
+        SymptomQueryRollup.user_id == user_id,
+        or_(
+            SymptomQueryRollup.kind == "severity",
+            (SymptomQueryRollup.kind == "week") & (SymptomQueryRollup.bucket >= first_week),
+        ),
+    )
+
+
+def build_stats(rows, weeks: int):
+    """Shape rollup rows into totals, per-severity counts and a gap-free weekly series (oldest first)."""
+    by_severity = {row.bucket: row.count for row in rows if row.kind == "severity"}
+    week_counts = {row.bucket: row.count for row in rows if row.kind == "week"}
+    this_week = datetime.datetime.utcnow()
+    series = []
+    for i in range(weeks - 1, -1, -1):
+        week = week_bucket(this_week - datetime.timedelta(weeks=i))
+        series.append({"week": week, "count": week_counts.get(week, 0)})
+    return {"total": sum(by_severity.values()), "by_severity": by_severity, "by_week": series}
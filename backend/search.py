@@ -0,0 +1,56 @@
+import os
+import re
+
+from sqlalchemy import Float, Integer, select, text
+from sqlalchemy.dialects.mysql import match
+
+from models import SEARCH_FTS_TABLE, SymptomQuery
+
+# Matches ranked by one search; its later pages page through this snapshot
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 200))
+
+# Relevance weights for bm25(): symptoms, summary, user_id (the filter column must not score)
+SQLITE_BM25_WEIGHTS = "1.0, 0.5, 0.0"
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(q: str):
+    return _TERM.findall(q.lower())
+
+
+def sqlite_match_expression(user_id: int, terms) -> str:
+    """FTS5 query: every term (quoted, so user input is never parsed as syntax) in the text columns, for one user."""
+    quoted = " ".join(f'"{term}"' for term in terms)
+    return f'user_id : "{user_id}" AND {{symptoms summary}} : ({quoted})'
+
+
+def history_search_query(dialect: str, user_id: int, q: str, limit: int = SEARCH_MAX_RESULTS):
+    """Ids of the best full-text matches in one user's history: best match first, then newest.
+
+    Returns None when the database has no full-text support (there is
+    deliberately no LIKE fallback).
+    """
+    terms = search_terms(q)
+    if dialect == "sqlite":
+        hits = (
+            text(
+                f"SELECT rowid AS id, -bm25({SEARCH_FTS_TABLE}, {SQLITE_BM25_WEIGHTS}) AS score "
+                f"FROM {SEARCH_FTS_TABLE} WHERE {SEARCH_FTS_TABLE} MATCH :match"
+            )
+            .bindparams(match=sqlite_match_expression(user_id, terms))
+            .columns(id=Integer, score=Float)
+            .subquery("hits")
+        )
+        score = hits.c.score
+        query = (
+            select(SymptomQuery.id)
+            .join(hits, hits.c.id == SymptomQuery.id)
+            .where(SymptomQuery.user_id == user_id)
+        )
+    elif dialect == "mysql":
+        score = match(SymptomQuery.symptoms, SymptomQuery.summary, against=" ".join(terms))
+        query = select(SymptomQuery.id).where(SymptomQuery.user_id == user_id, score > 0)
+    else:
+        return None
+    return query.order_by(score.desc(), SymptomQuery.id.desc()).limit(limit)
@@ -0,0 +1,68 @@
+"""Production entrypoint: several uvicorn worker processes behind one socket.
+
+    python serve.py                      # WEB_CONCURRENCY workers on HOST:PORT
+    python serve.py --workers 4 --port 8000
+
+Tables are created once here, before any worker starts, so workers never race
+on DDL and each one only imports the app and starts serving (the LLM client is
+built lazily per worker, see providers.LLMClients). On SIGTERM/SIGINT each
+worker stops accepting connections, lets in-flight requests finish for up to
+GRACEFUL_TIMEOUT_SECONDS, then flushes the write-behind queue and closes its
+pools. `python main.py` still runs a single development worker.
+
+Host-wide resources are shared out rather than multiplied by the worker count:
+PASSWORD_HASH_WORKERS (bcrypt processes for the whole host) is divided between
+the workers, and only one of them runs the retention purge (retention.LeaderLock).
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+# Before any backend import: modules read their settings at import time
+load_dotenv()
+
+import uvicorn
+
+SERVER_HOST = os.getenv("HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("PORT", 9002))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", 30))
+KEEP_ALIVE_SECONDS = int(os.getenv("KEEP_ALIVE_SECONDS", 5))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT_SECONDS)
+    parser.add_argument("--log-level", default=LOG_LEVEL)
+    args = parser.parse_args()
+
+    from models import create_tables, engine
+
+    create_tables()
+    # Workers open their own pools; the supervisor holds no connections while it runs
+    engine.dispose()
+    os.environ["CREATE_TABLES_ON_STARTUP"] = "false"
+    workers = max(1, args.workers)
+    # Each worker starts its own bcrypt pool; together they should not exceed the host total
+    os.environ["PASSWORD_HASH_WORKERS"] = str(max(1, PASSWORD_HASH_WORKERS // workers))
+
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=KEEP_ALIVE_SECONDS,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
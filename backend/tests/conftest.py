@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import uuid
+
+# Settings are read at import time, so they are fixed before the app is imported
+_workdir = tempfile.mkdtemp(prefix="symptom-checker-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+    LLM_BACKEND="fake",
+    LLM_PROVIDERS="stub",
+    LLM_MAX_RETRIES="0",
+    FAKE_LLM_LATENCY_MS="0",
+    BCRYPT_ROUNDS="4",
+    RATE_LIMIT_BACKEND="none",
+    RESPONSE_CACHE_BACKEND="none",
+    IDEMPOTENCY_BACKEND="memory",
+    WRITE_BEHIND_ENABLED="false",
+    RETENTION_DAYS="0",
+)
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.pop("GEMINI_API_KEY", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/register/", json={"username": "tester", "email": "tester@example.com", "password": "secret1"})
+    token = client.post("/token", data={"username": "tester@example.com", "password": "secret1"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def new_user(client):
+    """Registers a fresh user and returns their auth headers, for tests that count history."""
+
+    def register(email=None):
+        email = email or f"{uuid.uuid4().hex[:12]}@example.com"
+        client.post("/register/", json={"username": email, "email": email, "password": "secret1"})
+        token = client.post("/token", data={"username": email, "password": "secret1"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    return register
@@ -0,0 +1,22 @@
+import main
+
+
+def test_batch_answers_every_item_in_order_and_saves_them(client, new_user):
+    headers = new_user()
+    items = [{"symptoms": "mild headache"}, {"symptoms": "I have chest pain right now"}, {"symptoms": "a blocked nose"}]
+
+    response = client.post("/check_symptoms/batch", json={"items": items}, headers=headers)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["error"] is None for result in results)
+    # The emergency item is answered by the local pre-triage
+    assert results[1]["result"]["severity_estimate"] == "High Concern"
+    assert len(client.get("/history/", headers=headers).json()) == 3
+
+
+def test_oversized_batch_is_rejected(client, auth_headers):
+    items = [{"symptoms": "cough"}] * (main.BATCH_MAX_ITEMS + 1)
+    response = client.post("/check_symptoms/batch", json={"items": items}, headers=auth_headers)
+    assert response.status_code == 400
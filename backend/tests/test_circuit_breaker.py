@@ -0,0 +1,68 @@
+import main
+from llm import FakeModel
+from providers import LLMRouter, StubProvider
+from resilience import CLOSED, OPEN, CircuitBreaker
+
+SYMPTOMS = {"symptoms": "mild headache since this morning"}
+
+
+def failing_provider(monkeypatch, min_calls=4, cooldown_seconds=30):
+    model = FakeModel(latency_ms=0, failure_rate=1)
+    provider = StubProvider(model)
+    provider.breaker = CircuitBreaker("stub", min_calls=min_calls, cooldown_seconds=cooldown_seconds)
+    monkeypatch.setattr(main.llm_clients, "_clients", (None, LLMRouter([provider], main.parse_analysis)))
+    return model, provider
+
+
+def open_circuit(client, auth_headers, provider):
+    for _ in range(provider.breaker.min_calls):
+        response = client.post("/check_symptoms/", json=SYMPTOMS, headers=auth_headers)
+        assert response.status_code == 503
+        assert "Retry-After" not in response.headers
+    assert provider.breaker.state == OPEN
+
+
+def end_cooldown(provider):
+    provider.breaker.opened_at -= provider.breaker.cooldown_seconds
+
+
+def test_open_circuit_returns_503_with_retry_after(client, auth_headers, monkeypatch):
+    _, provider = failing_provider(monkeypatch)
+    open_circuit(client, auth_headers, provider)
+
+    response = client.post("/check_symptoms/", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 503
+    assert 1 <= int(response.headers["Retry-After"]) <= 30
+
+    response = client.post("/check_symptoms/stream", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 503
+    assert 1 <= int(response.headers["Retry-After"]) <= 30
+
+
+def test_half_open_probe_success_closes_circuit(client, auth_headers, monkeypatch):
+    model, provider = failing_provider(monkeypatch)
+    open_circuit(client, auth_headers, provider)
+
+    model.failure_rate = 0
+    end_cooldown(provider)
+    response = client.post("/check_symptoms/", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 200
+    assert provider.breaker.state == CLOSED
+
+    response = client.post("/check_symptoms/stream", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 200
+    assert "event: done" in response.text
+
+
+def test_half_open_probe_failure_reopens_circuit(client, auth_headers, monkeypatch):
+    _, provider = failing_provider(monkeypatch)
+    open_circuit(client, auth_headers, provider)
+
+    end_cooldown(provider)
+    response = client.post("/check_symptoms/", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 503
+    assert provider.breaker.state == OPEN
+
+    response = client.post("/check_symptoms/stream", json=SYMPTOMS, headers=auth_headers)
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,74 @@
+import models
+
+
+def check(client, headers, symptoms):
+    assert client.post("/check_symptoms/", json={"symptoms": symptoms}, headers=headers).status_code == 200
+
+
+def history_pages(client, headers, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"before": cursor} if cursor else {})}
+        response = client.get("/history/", params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append([item["id"] for item in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_history_pages_cover_every_entry_once_newest_first(client, new_user):
+    headers = new_user()
+    for i in range(5):
+        check(client, headers, f"mild cough, day {i}")
+
+    pages = history_pages(client, headers, 2)
+    ids = [query_id for page in pages for query_id in page]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 5
+
+
+def test_malformed_cursor_is_rejected(client, auth_headers):
+    assert client.get("/history/", params={"before": "bm90IGEgY3Vyc29y"}, headers=auth_headers).status_code == 400
+
+
+def test_unchanged_history_is_not_modified(client, new_user):
+    headers = new_user()
+    check(client, headers, "itchy eyes")
+    for path in ("/history/", "/history/latest", "/stats"):
+        first = client.get(path, headers=headers)
+        etag = first.headers["ETag"]
+        cached = client.get(path, headers={**headers, "If-None-Match": etag})
+        assert cached.status_code == 304 and cached.content == b""
+
+    check(client, headers, "itchy eyes and a runny nose")
+    changed = client.get("/history/", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert len(changed.json()) == 2
+
+
+def test_stats_follow_inserts_and_bulk_deletes(client, new_user):
+    headers = new_user()
+    for symptoms in ("mild headache", "slight fever", "sore throat"):
+        check(client, headers, symptoms)
+    ids = [item["id"] for item in client.get("/history/", headers=headers).json()]
+    stats = client.get("/stats", headers=headers).json()
+    assert stats["total"] == 3 == sum(stats["by_severity"].values())
+    assert stats["by_week"][-1]["count"] == 3
+    assert stats["latest"]["id"] == ids[0]
+
+    dry_run = client.post("/history/bulk_delete", json={"ids": ids[:2], "dry_run": True}, headers=headers).json()
+    assert dry_run == {"dry_run": True, "matched": 2}
+    deleted = client.post("/history/bulk_delete", json={"ids": ids[:2]}, headers=headers).json()
+    assert deleted == {"dry_run": False, "deleted": 2}
+
+    stats = client.get("/stats", headers=headers).json()
+    assert stats["total"] == 1 and stats["by_week"][-1]["count"] == 1
+    assert stats["latest"]["id"] == ids[2]
+    # The incrementally maintained rollups match a full recount
+    models.rebuild_rollups()
+    assert client.get("/stats", headers=headers).json() == stats
+
+
+def test_bulk_delete_needs_ids_or_a_range(client, auth_headers):
+    assert client.post("/history/bulk_delete", json={}, headers=auth_headers).status_code == 400
@@ -0,0 +1,118 @@
+import asyncio
+import sqlite3
+import uuid
+
+from idempotency import IdempotentRequests, MemoryIdempotencyStore, SQLiteIdempotencyStore
+
+SYMPTOMS = {"symptoms": "runny nose and sneezing since yesterday"}
+
+
+def history_count(client, auth_headers):
+    return len(client.get("/history/", params={"limit": 100}, headers=auth_headers).json())
+
+
+def keyed(auth_headers, key=None):
+    return {**auth_headers, "Idempotency-Key": key or str(uuid.uuid4())}
+
+
+def test_repeat_is_replayed_without_a_new_history_row(client, auth_headers):
+    headers = keyed(auth_headers)
+    before = history_count(client, auth_headers)
+
+    first = client.post("/check_symptoms/", json=SYMPTOMS, headers=headers)
+    repeat = client.post("/check_symptoms/", json=SYMPTOMS, headers=headers)
+    streamed = client.post("/check_symptoms/stream", json=SYMPTOMS, headers=headers)
+
+    assert first.status_code == repeat.status_code == streamed.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert repeat.headers["Idempotent-Replayed"] == "true"
+    assert repeat.json() == first.json()
+    # The stream replays the stored answer as a single `done` event
+    assert streamed.headers["Idempotent-Replayed"] == "true"
+    assert streamed.text.count("event: ") == 1 and streamed.text.startswith("event: done")
+    assert history_count(client, auth_headers) == before + 1
+
+
+def test_key_reused_with_different_symptoms_is_rejected(client, auth_headers):
+    headers = keyed(auth_headers)
+    assert client.post("/check_symptoms/stream", json=SYMPTOMS, headers=headers).status_code == 200
+
+    response = client.post("/check_symptoms/", json={"symptoms": "sore knee"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_concurrent_repeat_attaches_to_the_first_run():
+    requests = IdempotentRequests(MemoryIdempotencyStore())
+    calls = []
+
+    async def first():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return '{"summary": "ok"}'
+
+    async def scenario():
+        return await asyncio.gather(*(requests.run(1, "key", "symptoms", first) for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+    assert {body for body, _ in results} == {'{"summary": "ok"}'}
+
+
+def test_dropped_stream_keeps_running_and_its_retry_attaches():
+    requests = IdempotentRequests(MemoryIdempotencyStore())
+    runs = []
+
+    async def events(claim):
+        runs.append(claim)
+        yield "section"
+        await asyncio.sleep(0.05)
+        await requests.complete(claim, '{"summary": "ok"}')
+        yield "done"
+
+    async def scenario():
+        claim, _ = await requests.claim(1, "key", "symptoms")
+        relay = requests.stream(events(claim))
+        assert await relay.__anext__() == "section"
+        await relay.aclose()  # the client went away mid-stream
+
+        retry = await requests.claim(1, "key", "symptoms")
+        await requests.drain()
+        return retry
+
+    assert asyncio.run(scenario()) == (None, '{"summary": "ok"}')
+    assert len(runs) == 1
+
+
+def test_failed_first_run_lets_the_waiting_repeat_run():
+    requests = IdempotentRequests(MemoryIdempotencyStore())
+
+    async def failing():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("LLM down")
+
+    async def succeeding():
+        return "body"
+
+    async def scenario():
+        first = asyncio.ensure_future(requests.run(1, "key", "symptoms", failing))
+        await asyncio.sleep(0)
+        repeat = await requests.run(1, "key", "symptoms", succeeding)
+        assert isinstance((await asyncio.gather(first, return_exceptions=True))[0], RuntimeError)
+        return repeat
+
+    assert asyncio.run(scenario()) == ("body", False)
+
+
+def test_locked_sqlite_store_fails_open(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    requests = IdempotentRequests(SQLiteIdempotencyStore(path, timeout_ms=10))
+    locker = sqlite3.connect(path, isolation_level=None)
+    locker.execute("BEGIN EXCLUSIVE")
+    try:
+        claim = asyncio.run(requests.claim(1, "key", "symptoms"))
+    finally:
+        locker.execute("ROLLBACK")
+        locker.close()
+    assert claim == (None, None)
+    assert requests.stats()["errors"] == 1
@@ -0,0 +1,50 @@
+import datetime
+import uuid
+
+import models
+from models import SessionLocal, SymptomQuery, User
+from retention import LeaderLock, RetentionPurger
+
+
+def add_history(email, ages_in_days):
+    """Rows created `ages_in_days` ago (via the ORM, so their rollups are counted as usual)."""
+    now = datetime.datetime.utcnow()
+    with SessionLocal() as db:
+        user_id = db.query(User.id).filter(User.email == email).scalar()
+        db.add_all([
+            SymptomQuery(
+                user_id=user_id, symptoms="old cough", response="{}", summary="Old", severity_estimate="Low Concern",
+                details='{"possible_common_causes":[],"self_care_tips":[],"red_flags":[]}',
+                created_at=now - datetime.timedelta(days=age),
+            )
+            for age in ages_in_days
+        ])
+        db.commit()
+
+
+def test_purge_deletes_only_expired_rows_in_batches(client, new_user, tmp_path):
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    headers = new_user(email)
+    add_history(email, [400, 500, 600, 1, 2])
+    purger = RetentionPurger(days=365, batch_size=2, pause_ms=0, leader_lock=LeaderLock(str(tmp_path / "lock")))
+
+    dry_run = client.portal.call(lambda: purger.run_once(dry_run=True))
+    assert dry_run["eligible"] >= 3 and dry_run["deleted"] == 0
+    run = client.portal.call(purger.run_once)
+
+    assert run["deleted"] == run["eligible"] >= 3 and run["batches"] >= 2
+    assert len(client.get("/history/", headers=headers).json()) == 2
+    stats = client.get("/stats", headers=headers).json()
+    assert stats["total"] == 2
+    models.rebuild_rollups()
+    assert client.get("/stats", headers=headers).json() == stats
+
+
+def test_only_the_lock_holder_purges(tmp_path):
+    path = str(tmp_path / "lock")
+    leader, follower = LeaderLock(path), LeaderLock(path)
+    assert leader.acquire()
+    assert not follower.acquire()
+    leader.release()
+    assert follower.acquire()
+    follower.release()
@@ -0,0 +1,36 @@
+def check(client, headers, symptoms):
+    assert client.post("/check_symptoms/", json={"symptoms": symptoms}, headers=headers).status_code == 200
+
+
+def search_ids(client, headers, q, limit, before=None):
+    params = {"q": q, "limit": limit}
+    if before:
+        params["before"] = before
+    response = client.get("/history/search", params=params, headers=headers)
+    assert response.status_code == 200
+    return [item["id"] for item in response.json()], response.headers.get("X-Next-Cursor")
+
+
+def test_search_pages_follow_the_first_ranking_despite_writes(client, new_user):
+    headers = new_user()
+    for repeats in range(1, 6):
+        check(client, headers, " ".join(["wheezing"] * repeats) + f" and a sore throat, note {repeats}")
+    ranking, _ = search_ids(client, headers, "wheezing throat", 100)
+    assert len(ranking) == 5
+
+    pages, cursor = search_ids(client, headers, "wheezing throat", 2)
+    # Writes between pages change bm25 statistics and add matches
+    other = new_user()
+    for _ in range(5):
+        check(client, other, "wheezing wheezing")
+    check(client, headers, "wheezing again")
+    while cursor:
+        page, cursor = search_ids(client, headers, "wheezing throat", 2, cursor)
+        pages += page
+
+    assert pages == ranking
+
+
+def test_search_rejects_a_malformed_cursor(client, auth_headers):
+    response = client.get("/history/search", params={"q": "cough", "before": "not-a-cursor"}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,64 @@
+import pytest
+
+from triage import HIGH_CONCERN, MODERATE_CONCERN, NO_MATCH, SELF_HARM, emergency_response, triage
+
+
+@pytest.mark.parametrize("symptoms", [
+    "I have chest pain",
+    "my chest pain started 20 minutes ago",
+    "I have had trouble breathing since an hour ago",
+    "I have a cough, and I have chest pain",
+    "My dad had a seizure last year but I have chest pain now",
+])
+def test_current_first_person_emergency_is_answered_locally(symptoms):
+    result = triage(symptoms, mode="on")
+    assert result.emergency
+    assert result.severity == HIGH_CONCERN
+
+
+@pytest.mark.parametrize("symptoms", [
+    "My dad has chest pain",
+    "I feel fine and my sister has chest pain",
+    "I had chest pain last week",
+    "I had chest pain a few years ago",
+    "chest pain since an hour ago",
+])
+def test_other_emergency_matches_keep_the_severity_floor(symptoms):
+    result = triage(symptoms, mode="on")
+    assert not result.emergency
+    assert result.severity == HIGH_CONCERN
+    assert result.red_flags == ["Chest pain or pressure"]
+
+
+def test_urgent_match_sets_moderate_floor():
+    result = triage("I fainted 10 minutes ago", mode="on")
+    assert not result.emergency
+    assert result.severity == MODERATE_CONCERN
+
+
+@pytest.mark.parametrize("symptoms", [
+    "no chest pain",
+    "I have a cough but no chest pain",
+    "I dont have chest pain or a fever",
+])
+def test_negated_match_is_ignored(symptoms):
+    assert triage(symptoms, mode="on") == NO_MATCH
+
+
+def test_negation_stops_at_clause_break():
+    assert triage("No fever. Chest pain since this morning", mode="on").severity == HIGH_CONCERN
+
+
+def test_hint_mode_never_answers_locally():
+    result = triage("I have chest pain", mode="hint")
+    assert not result.emergency
+    assert result.severity == HIGH_CONCERN
+
+
+def test_self_harm_gets_crisis_guidance():
+    result = triage("I want to hurt myself", mode="on")
+    assert result.emergency and result.red_flags == [SELF_HARM]
+    response = emergency_response(result)
+    assert "not alone" in response["summary"]
+    assert any("crisis line" in tip for tip in response["self_care_tips"])
+    assert "stay in a safe, comfortable position" not in " ".join(response["self_care_tips"])
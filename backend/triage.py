@@ -0,0 +1,313 @@
+import os
+import re
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+from metrics import Counter
+
+# Local red-flag pre-triage, run before any LLM call.
+# "on": a multi-word emergency phrase the user states about themselves (first person,
+#   present) is answered locally at High Concern without calling the LLM; any other
+#   emergency match (about someone else, in the past, a single word) still raises the
+#   LLM's severity to at least High Concern, and urgent phrases to at least Moderate Concern.
+# "hint": nothing is answered locally, every match only raises the severity.
+# "off": disabled.
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "on")
+
+triage_outcomes = Counter("triage_outcomes_total", "Local pre-triage results (emergency, hint, none)", ("outcome",))
+
+MODERATE_CONCERN = "Moderate Concern"
+HIGH_CONCERN = "High Concern"
+SEVERITY_ORDER = ("Low Concern", MODERATE_CONCERN, HIGH_CONCERN)
+
+DISCLAIMER = (
+    "This response is for educational purposes only and is not a medical diagnosis or professional medical advice. "
+    "If you are worried about your symptoms or they worsen, please consult a licensed healthcare professional."
+)
+
+SELF_HARM = "Thoughts of self-harm"
+
+# Red flag label -> phrases. Phrases are matched on whole words after normalize_text.
+EMERGENCY_PHRASES = {
+    "Chest pain or pressure": [
+        "chest pain", "chest pains", "chest pressure", "chest tightness", "tight chest", "tightness in my chest",
+        "pain in my chest", "pressure in my chest", "crushing chest",
+    ],
+    "Difficulty breathing": [
+        "difficulty breathing", "trouble breathing", "hard to breathe", "struggling to breathe", "cant breathe",
+        "cannot breathe", "unable to breathe", "short of breath", "shortness of breath", "gasping for air",
+        "choking",
+    ],
+    "Loss of bladder or bowel control": [
+        "loss of bladder control", "lost bladder control", "loss of bowel control", "lost bowel control",
+        "cant control my bladder", "cant control my bowels", "numbness in my groin", "saddle numbness",
+    ],
+    "Signs of stroke": [
+        "face drooping", "facial droop", "drooping face", "slurred speech", "slurring my words",
+        "sudden numbness", "sudden weakness", "weakness on one side", "numbness on one side",
+        "cant move my arm", "cant move my leg", "sudden confusion", "sudden vision loss", "lost my vision",
+    ],
+    "Loss of consciousness or seizure": [
+        "lost consciousness", "loss of consciousness", "unconscious", "unresponsive",
+        "seizure", "seizures", "convulsions", "having a seizure",
+    ],
+    "Severe bleeding": [
+        "severe bleeding", "heavy bleeding", "bleeding heavily", "bleeding wont stop", "coughing up blood",
+        "vomiting blood", "throwing up blood",
+    ],
+    "Severe allergic reaction": [
+        "anaphylaxis", "throat swelling", "throat is closing", "swollen tongue", "tongue swelling",
+        "lips swelling",
+    ],
+    SELF_HARM: [
+        "suicidal", "feel suicidal", "feeling suicidal", "kill myself", "end my life", "want to die",
+        "want to hurt myself", "self harm",
+    ],
+    "Worst headache of your life": [
+        "worst headache of my life", "thunderclap headache", "worst headache ever",
+    ],
+}
+
+URGENT_PHRASES = {
+    "High or persistent fever": ["high fever", "fever for a week", "fever wont go down", "temperature of 104", "temperature of 40"],
+    "Stiff neck with fever or headache": ["stiff neck"],
+    "Blood in stool or urine": ["blood in my stool", "blood in stool", "bloody stool", "black stool", "blood in my urine", "blood in urine"],
+    "Fainting or near-fainting": ["fainted", "fainting", "passed out", "blacked out"],
+    "Severe or sudden pain": ["severe pain", "unbearable pain", "excruciating", "sudden severe", "severe abdominal pain"],
+    "Numbness or weakness": [
+        "numbness in my legs", "numbness in my arms", "numbness in my face", "weakness in my legs",
+        "weakness in my arms", "tingling in my legs",
+    ],
+    "Confusion or disorientation": ["disoriented", "suddenly confused", "very confused", "confused about where i am"],
+    "Pregnancy complications": ["bleeding while pregnant", "pregnant and bleeding"],
+}
+
+# A match preceded (within the same clause) by one of these words is not counted
+NEGATIONS = {"no", "not", "without", "never", "denies", "deny", "dont", "didnt", "doesnt", "havent", "hasnt", "isnt", "wasnt", "arent"}
+NEGATION_WINDOW = 3
+
+# Who a clause is about: the last of these before a match is its subject. Only a
+# first-person (or no) subject makes a match eligible for the local emergency answer;
+# matches about someone else still set the severity floor.
+FIRST_PERSON = ["i", "im", "ive", "id", "me", "my", "myself"]
+THIRD_PERSON = [
+    "he", "hes", "she", "shes", "they", "theyre", "his", "her", "their", "someone", "somebody",
+    "mother", "mom", "mum", "father", "dad", "brother", "sister", "son", "daughter", "wife", "husband",
+    "partner", "boyfriend", "girlfriend", "friend", "child", "kid", "baby", "grandmother", "grandma",
+    "grandfather", "grandpa", "aunt", "uncle", "cousin", "neighbour", "neighbor", "coworker", "colleague",
+]
+# Matches in a clause that places them in the past are not answered locally either (they
+# still set the floor). "ago" only counts after a unit of days or more: "an hour ago" is now.
+PAST_MARKERS = [
+    "day ago", "days ago", "week ago", "weeks ago", "month ago", "months ago", "year ago", "years ago",
+    "last week", "last month", "last year", "years back", "as a child", "as a kid", "when i was",
+    "history of", "used to", "in the past", "previously",
+]
+
+_CLAUSE = "|"
+_CLAUSE_BREAKS = re.compile(r"[.,;:!?\n()]+|\b(?:but|and)\b")
+_APOSTROPHES = re.compile(r"['’]")
+_NON_WORD = re.compile(r"[^a-z0-9|]+")
+
+
+def normalize_text(text: str) -> List[str]:
+    """Lowercase word tokens; clause breaks become a '|' token that no pattern contains."""
+    text = _APOSTROPHES.sub("", text.lower())
+    text = _CLAUSE_BREAKS.sub(f" {_CLAUSE} ", text)
+    return _NON_WORD.sub(" ", text).split()
+
+
+EMERGENCY, URGENT, SELF, OTHER, PAST = "emergency", "urgent", "self", "other", "past"
+
+
+class Pattern(NamedTuple):
+    label: str
+    kind: str
+    length: int
+    first_person: bool  # the phrase itself is about the speaker ("tightness in my chest")
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over word tokens.
+
+    All phrases are found in one left-to-right pass, so the cost depends on
+    the length of the text, not on the size of the dictionary.
+    """
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for words, pattern in phrases:
+            state = 0
+            for word in words:
+                next_state = self.goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][word] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern)
+
+        # Breadth-first fail links; each state also inherits the outputs of its fail state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(word, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, tokens):
+        """Yields (start index, Pattern) for every phrase occurrence in `tokens`."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for pattern in output[state]:
+                yield i - pattern.length + 1, pattern
+
+
+def _negated(tokens, start):
+    for token in reversed(tokens[max(0, start - NEGATION_WINDOW):start]):
+        if token == _CLAUSE:
+            return False
+        if token in NEGATIONS:
+            return True
+    return False
+
+
+class TriageResult(NamedTuple):
+    emergency: bool  # answer locally, without the LLM
+    severity: Optional[str]  # minimum severity the answer should carry, None when nothing matched
+    red_flags: List[str]
+
+
+NO_MATCH = TriageResult(False, None, [])
+
+
+def build_matcher():
+    """One automaton for the red flags and the context words (subjects, past markers) around them."""
+    tables = [(EMERGENCY_PHRASES, EMERGENCY), (URGENT_PHRASES, URGENT)]
+    tables += [({kind: words}, kind) for words, kind in ((FIRST_PERSON, SELF), (THIRD_PERSON, OTHER), (PAST_MARKERS, PAST))]
+    phrases = []
+    for table, kind in tables:
+        for label, variants in table.items():
+            for variant in variants:
+                words = normalize_text(variant)
+                first_person = any(word in FIRST_PERSON for word in words)
+                phrases.append((words, Pattern(label, kind, len(words), first_person)))
+    return PhraseMatcher(phrases)
+
+
+matcher = build_matcher()
+
+
+def triage(symptoms: str, mode: str = TRIAGE_MODE) -> TriageResult:
+    if mode == "off":
+        return NO_MATCH
+    tokens = normalize_text(symptoms)
+    clause, clauses = 0, []
+    for token in tokens:
+        clause += token == _CLAUSE
+        clauses.append(clause)
+
+    flags = []
+    subjects = []  # (clause, end index, is the speaker)
+    past = set()
+    for start, pattern in matcher.find(tokens):
+        if pattern.kind == PAST:
+            past.add(clauses[start])
+        elif pattern.kind in (SELF, OTHER):
+            subjects.append((clauses[start], start + pattern.length, pattern.kind == SELF))
+        else:
+            flags.append((start, pattern))
+
+    labels = []
+    emergency = high = False
+    for start, pattern in flags:
+        if _negated(tokens, start):
+            continue
+        if pattern.label not in labels:
+            labels.append(pattern.label)
+        if pattern.kind != EMERGENCY:
+            continue
+        high = True
+        # Only the local answer depends on context; the severity floor above does not
+        speaker = _subject(subjects, clauses[start], start)
+        current = clauses[start] not in past and speaker is not False
+        emergency = emergency or (current and pattern.length > 1 and (speaker or pattern.first_person))
+    if not labels:
+        return NO_MATCH
+    return TriageResult(emergency and mode == "on", HIGH_CONCERN if high else MODERATE_CONCERN, labels)
+
+
+def _subject(subjects, clause, start):
+    """True/False when the last subject before `start` in its clause is the speaker/someone else, None if none."""
+    speaker = None
+    for subject_clause, end, is_speaker in subjects:
+        if subject_clause == clause and end <= start:
+            speaker = is_speaker
+    return speaker
+
+
+def raise_severity(severity: str, floor: Optional[str]) -> str:
+    """The higher of `severity` and `floor`; unrecognised severities are replaced by the floor."""
+    if floor is None:
+        return severity
+    current = SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else -1
+    return severity if current >= SEVERITY_ORDER.index(floor) else floor
+
+
+def emergency_response(result: TriageResult) -> dict:
+    """A complete StructuredSymptomResponse payload for a locally detected emergency."""
+    if SELF_HARM in result.red_flags:
+        return self_harm_response(result)
+    flags = ", ".join(label.lower() for label in result.red_flags)
+    return {
+        "summary": f"You describe symptoms that can be a sign of a medical emergency ({flags}).",
+        "possible_common_causes": [
+            "Symptoms like this are sometimes associated with conditions that need prompt medical assessment.",
+            "Only a healthcare professional who can examine you can tell what is causing them.",
+        ],
+        "severity_estimate": HIGH_CONCERN,
+        "self_care_tips": [
+            "Stop any physical activity and stay in a safe, comfortable position.",
+            "Do not drive yourself; ask someone nearby to stay with you.",
+        ],
+        "red_flags": result.red_flags + ["Symptoms getting worse while you wait for help"],
+        "consultation_timing": "Now. Please call your local emergency number or go to the nearest emergency department.",
+        "disclaimer": DISCLAIMER,
+    }
+
+
+def self_harm_response(result: TriageResult) -> dict:
+    """Crisis guidance instead of physical first-aid advice, whatever else was flagged."""
+    return {
+        "summary": (
+            "It sounds like you may be having thoughts of harming yourself. You are not alone, "
+            "and support is available right now."
+        ),
+        "possible_common_causes": [
+            "Thoughts like these often come with overwhelming stress, pain, or conditions such as depression, "
+            "and they can get better with support.",
+            "A crisis counsellor or healthcare professional can help you work through what you are feeling.",
+        ],
+        "severity_estimate": HIGH_CONCERN,
+        "self_care_tips": [
+            "If you might act on these thoughts, call your local emergency number now.",
+            "Talk to a crisis line: in the US call or text 988; elsewhere, find a local helpline at findahelpline.com.",
+            "Reach out to someone you trust and tell them how you are feeling; you do not have to go through this alone.",
+            "Stay somewhere safe, away from anything you could use to hurt yourself.",
+        ],
+        "red_flags": result.red_flags + ["Having a plan or the means to act on these thoughts"],
+        "consultation_timing": "Now. Please contact a crisis line or your local emergency number, or go to the nearest emergency department.",
+        "disclaimer": DISCLAIMER,
+    }
@@ -0,0 +1,144 @@
+import asyncio
+import os
+
+from sqlalchemy.orm import make_transient
+
+from metrics import Counter
+from models import AsyncSessionLocal
+from resilience import backoff_delay
+
+# Write-behind persistence (opt-in): symptom queries are queued and inserted in
+# periodic batches instead of one commit per request. History becomes eventually
+# consistent, lagging by at most one flush interval.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", 200))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+# A batch that fails to commit goes back to the front of the queue and is retried with
+# jittered exponential backoff; after this many retries its rows are dropped
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 5))
+WRITE_BEHIND_RETRY_BASE_MS = int(os.getenv("WRITE_BEHIND_RETRY_BASE_MS", 200))
+WRITE_BEHIND_RETRY_MAX_MS = int(os.getenv("WRITE_BEHIND_RETRY_MAX_MS", 5000))
+
+write_behind_retries = Counter("write_behind_retries_total", "Write-behind batches that failed to commit and were requeued")
+write_behind_dropped_rows = Counter("write_behind_dropped_rows_total", "History rows dropped after exhausting write-behind retries")
+
+
+class WriteBehindQueue:
+    """Collects ORM rows and inserts them in grouped transactions from one background task."""
+
+    def __init__(self, interval_ms=WRITE_BEHIND_INTERVAL_MS, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, retry_base_ms=WRITE_BEHIND_RETRY_BASE_MS,
+                 retry_max_ms=WRITE_BEHIND_RETRY_MAX_MS, session_factory=AsyncSessionLocal):
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_base_ms = retry_base_ms
+        self.retry_max_ms = retry_max_ms
+        self.session_factory = session_factory
+        self._pending = []
+        self._failures = 0  # consecutive failures of the batch at the front of the queue
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.retries = 0
+        self.dropped_rows = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush everything still queued."""
+        if self._task is None:
+            return
+        # Let an in-progress flush finish rather than cancelling it mid-commit
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    def enqueue(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Insert everything queued, oldest first.
+
+        A batch that fails is put back at the front of the queue and retried
+        after a backoff, so rows keep their order; once it has failed
+        max_retries more times, its rows are dropped and counted (at shutdown,
+        together with everything still queued).
+        """
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            try:
+                async with self.session_factory() as db:
+                    db.add_all(batch)
+                    try:
+                        await db.commit()
+                    except Exception:
+                        # Expunges the rows from the failed transaction so they can be added again
+                        await db.rollback()
+                        raise
+            except Exception as e:
+                if self._failures >= self.max_retries:
+                    if self._stopping:
+                        # Shutting down with the database still failing: give up on everything left
+                        batch += self._pending
+                        self._pending = []
+                    self._failures = 0
+                    self.dropped_rows += len(batch)
+                    write_behind_dropped_rows.inc(len(batch))
+                    print(f"Write-behind flush error ({len(batch)} rows dropped after {self.max_retries} retries): {e}")
+                    continue
+                delay = backoff_delay(self._failures, self.retry_base_ms, self.retry_max_ms)
+                self._failures += 1
+                self.retries += 1
+                write_behind_retries.inc()
+                print(f"Write-behind flush error ({len(batch)} rows, retry {self._failures} in {delay:.1f}s): {e}")
+                for row in batch:
+                    # Forget any key assigned by the rolled-back flush, so the retry inserts afresh
+                    make_transient(row)
+                    row.id = None
+                self._pending[:0] = batch
+                await asyncio.sleep(delay)
+                continue
+            self._failures = 0
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+
+    def stats(self):
+        return {
+            "enabled": self.running,
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "retries": self.retries,
+            "dropped_rows": self.dropped_rows,
+        }
+
+
+symptom_query_writer = WriteBehindQueue()
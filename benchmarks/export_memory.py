@@ -0,0 +1,123 @@
+"""Memory profile of the streaming history export on a large synthetic table.
+
+    python benchmarks/export_memory.py --rows 2000000
+    python benchmarks/export_memory.py --rows 2000000 --format csv --mode all
+
+Builds a throwaway SQLite database with --rows symptom_queries rows, then
+exports it to a discarding sink while sampling the process RSS. With
+--mode stream (the backend's export path) RSS stays flat; --mode all loads
+every row with .all() first, for comparison.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+SYMPTOMS = ["headache", "sore throat", "fever", "cough", "back pain", "nausea", "fatigue", "dizziness", "rash"]
+SEVERITIES = ["Low Concern", "Moderate Concern", "High Concern"]
+DETAILS = json.dumps({
+    "possible_common_causes": ["This may be related to a common viral infection."],
+    "self_care_tips": ["Rest", "Good hydration"],
+    "red_flags": ["Difficulty breathing", "High fever that does not improve"],
+}, separators=(",", ":"))
+
+
+def rss_mb():
+    """Current resident set size (Linux), else the peak reported by getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def populate(path, rows, users, seed):
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    def generate():
+        for i in range(1, rows + 1):
+            symptoms = f"I have {rng.choice(SYMPTOMS)} and {rng.choice(SYMPTOMS)} for {rng.randint(1, 9)} days"
+            created_at = start + datetime.timedelta(seconds=i * 7)
+            yield (i, rng.randint(1, users), symptoms, None, created_at.isoformat(" "),
+                   f"Summary of {symptoms}", rng.choice(SEVERITIES), DETAILS)
+
+    conn.executemany("INSERT INTO symptom_queries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", generate())
+    conn.commit()
+    conn.close()
+
+
+class Sink:
+    """Discards output, counting bytes and sampling RSS every `every` writes."""
+
+    def __init__(self, every):
+        self.bytes = 0
+        self.writes = 0
+        self.every = every
+        self.samples = []
+
+    def write(self, text):
+        self.bytes += len(text)
+        self.writes += 1
+        if self.writes % self.every == 0:
+            self.samples.append(rss_mb())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--mode", choices=("stream", "all"), default="stream")
+    parser.add_argument("--chunk-rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="symptom-export-") as workdir:
+        path = os.path.join(workdir, "export.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+        from export import export_query, export_to, serialize_chunk
+        from models import SymptomQuery, engine
+
+        SymptomQuery.__table__.create(engine)
+        start = time.perf_counter()
+        populate(path, args.rows, args.users, args.seed)
+        print(f"Populated {args.rows:,} rows in {time.perf_counter() - start:.1f}s "
+              f"({os.path.getsize(path) / 1e6:.0f} MB on disk)")
+
+        baseline = rss_mb()
+        sink = Sink(every=max(1, args.rows // args.chunk_rows // 10))
+        start = time.perf_counter()
+        if args.mode == "stream":
+            exported = export_to(sink, args.format, chunk_rows=args.chunk_rows)
+        else:
+            with engine.connect() as conn:
+                rows = conn.execute(export_query()).all()
+            sink.samples.append(rss_mb())
+            sink.write(serialize_chunk(args.format, rows, first=True))
+            exported = len(rows)
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    peak = max(sink.samples + [rss_mb()])
+    print(f"Exported {exported:,} rows ({sink.bytes / 1e6:.0f} MB of {args.format}) in {elapsed:.1f}s, "
+          f"{exported / elapsed:,.0f} rows/s")
+    print(f"RSS before export {baseline:.0f} MB, peak during export {peak:.0f} MB (+{peak - baseline:.0f} MB)")
+    print("RSS samples (MB): " + " ".join(f"{sample:.0f}" for sample in sink.samples))
+
+
+if __name__ == "__main__":
+    main()
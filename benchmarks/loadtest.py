@@ -0,0 +1,280 @@
+"""Offline load test for the FastAPI backend.
+
+Starts the app in-process against a throwaway SQLite database, swaps
+genai.GenerativeModel for a local stub (no API quota is spent) and drives
+mixed register/token/check_symptoms/history/delete traffic over real HTTP.
+
+    python benchmarks/loadtest.py --concurrency 32 --duration 20 --output results.json
+    python benchmarks/loadtest.py --baseline benchmarks/baselines/default.json
+
+With --baseline, exits non-zero when p95 latency or throughput regresses by
+more than --threshold percent against the stored results.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+SYMPTOM_WORDS = [
+    "headache", "sore throat", "fever", "cough", "back pain", "nausea", "fatigue",
+    "dizziness", "runny nose", "stomach ache", "joint pain", "rash",
+]
+DURATIONS = ["for a day", "for two days", "since this morning", "for a week"]
+
+OPERATIONS = ("register", "token", "check_symptoms", "history", "delete")
+
+# Per-operation p95s from fewer samples than this are too noisy to gate on
+MIN_SAMPLES_FOR_COMPARISON = 100
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of traffic to generate")
+    parser.add_argument("--llm-latency-ms", type=int, default=800, help="Stub LLM latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Fraction of stub LLM calls that fail")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0, help="Fraction of stub LLM calls that return truncated JSON")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="bcrypt cost used by the app under test")
+    parser.add_argument(
+        "--mix", default="check_symptoms=5,history=10,token=1,delete=1",
+        help="Relative weights of operations run by each virtual user after it registers",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Allowed regression, percent")
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    """Must run before the backend modules are imported: they read settings at import time."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["RESPONSE_CACHE_SQLITE_PATH"] = os.path.join(workdir, "response_cache.db")
+    os.environ["GEMINI_API_KEY"] = "loadtest-not-a-real-key"
+    os.environ["LLM_BACKEND"] = "gemini"
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # Virtual users check far more often than real ones; measure capacity, not the per-user limit
+    os.environ["RATE_LIMIT_BACKEND"] = "none"
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+    import google.generativeai as genai
+    from llm import FakeModel
+
+    def stub_model(*_args, **_kwargs):
+        return FakeModel(
+            latency_ms=args.llm_latency_ms,
+            failure_rate=args.llm_failure_rate,
+            malformed_rate=args.llm_malformed_rate,
+        )
+
+    genai.configure = lambda **_kwargs: None
+    genai.GenerativeModel = stub_model
+
+
+def start_server(app):
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {op: [] for op in OPERATIONS}
+        self.errors = {op: 0 for op in OPERATIONS}
+
+    def record(self, op, seconds, ok):
+        self.samples[op].append(seconds)
+        if not ok:
+            self.errors[op] += 1
+
+    def summary(self, elapsed):
+        operations = {}
+        all_samples = []
+        for op in OPERATIONS:
+            samples = self.samples[op]
+            all_samples.extend(samples)
+            if not samples:
+                continue
+            operations[op] = {
+                "count": len(samples),
+                "errors": self.errors[op],
+                "rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+        return {
+            "elapsed_s": elapsed,
+            "total_requests": len(all_samples),
+            "total_errors": sum(self.errors.values()),
+            "rps": len(all_samples) / elapsed,
+            "p50_ms": (percentile(all_samples, 50) or 0) * 1000,
+            "p95_ms": (percentile(all_samples, 95) or 0) * 1000,
+            "p99_ms": (percentile(all_samples, 99) or 0) * 1000,
+            "operations": operations,
+        }
+
+
+async def virtual_user(client, recorder, rng, weights, deadline):
+    async def timed(op, coro):
+        start = time.perf_counter()
+        try:
+            response = await coro
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        recorder.record(op, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+    password = "loadtest-password"
+    await timed("register", client.post("/register/", json={"username": email.split("@")[0], "email": email, "password": password}))
+
+    async def login():
+        response = await timed("token", client.post("/token", data={"username": email, "password": password}))
+        return {"Authorization": f"Bearer {response.json()['access_token']}"} if response else None
+
+    headers = await login()
+    if headers is None:
+        return
+
+    ops, op_weights = zip(*weights.items())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, op_weights)[0]
+        if op == "token":
+            headers = await login() or headers
+        elif op == "check_symptoms":
+            symptoms = f"I have {' and '.join(rng.sample(SYMPTOM_WORDS, 2))} {rng.choice(DURATIONS)}"
+            await timed(op, client.post("/check_symptoms/", json={"symptoms": symptoms}, headers=headers))
+        elif op == "history":
+            await timed(op, client.get("/history/", headers=headers))
+        elif op == "delete":
+            response = await client.get("/history/", params={"limit": 1}, headers=headers)
+            items = response.json() if response.status_code == 200 else []
+            if items:
+                await timed(op, client.delete(f"/history/{items[0]['id']}", headers=headers))
+
+
+async def drive(base_url, args):
+    import httpx
+
+    weights = {}
+    for part in args.mix.split(","):
+        name, weight = part.split("=")
+        if name not in OPERATIONS or name == "register":
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        weights[name] = float(weight)
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, recorder, random.Random(args.seed + i), weights, deadline)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    return recorder.summary(elapsed)
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of regression messages (empty when within threshold)."""
+    failures = []
+    limit = 1 + threshold / 100
+    if results["p95_ms"] > baseline["p95_ms"] * limit:
+        failures.append(f"p95 {results['p95_ms']:.1f}ms vs baseline {baseline['p95_ms']:.1f}ms")
+    if results["rps"] * limit < baseline["rps"]:
+        failures.append(f"throughput {results['rps']:.1f} rps vs baseline {baseline['rps']:.1f} rps")
+    for op, base in baseline.get("operations", {}).items():
+        current = results["operations"].get(op)
+        if not current or min(current["count"], base["count"]) < MIN_SAMPLES_FOR_COMPARISON:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * limit:
+            failures.append(f"{op} p95 {current['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+    return failures
+
+
+def print_report(results):
+    print(f"{'operation':<16}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, stats in results["operations"].items():
+        print(f"{op:<16}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>9.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"{'total':<16}{results['total_requests']:>8}{results['total_errors']:>8}{results['rps']:>9.1f}"
+          f"{results['p50_ms']:>10.1f}{results['p95_ms']:>10.1f}{results['p99_ms']:>10.1f}")
+
+
+def main():
+    args = parse_args()
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory(prefix="symptom-loadtest-") as workdir:
+        configure_environment(args, workdir)
+        import main as backend
+
+        server, thread, base_url = start_server(backend.app)
+        try:
+            results = asyncio.run(drive(base_url, args))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    results["config"] = {
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "llm_latency_ms": args.llm_latency_ms,
+        "llm_failure_rate": args.llm_failure_rate,
+        "llm_malformed_rate": args.llm_malformed_rate,
+        "mix": args.mix,
+    }
+    print_report(results)
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print(f"Warning: baseline was recorded with a different configuration: {baseline.get('config')}")
+        failures = compare(results, baseline, args.threshold)
+        if failures:
+            print(f"REGRESSION (> {args.threshold:.0f}% worse than baseline):")
+            for failure in failures:
+                print(f"  - {failure}")
+            sys.exit(1)
+        print("Within baseline threshold.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compare per-request input size of the legacy and structured prompt modes.
+
+    python benchmarks/prompt_tokens.py
+    python benchmarks/prompt_tokens.py --symptoms "I have a headache and sore throat for two days."
+
+With GEMINI_API_KEY set, exact counts come from the model's count_tokens
+(which includes the system instruction, since it is billed on every call).
+Without a key, tokens are estimated at ~4 characters per token.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from prompts import SYSTEM_INSTRUCTION, build_legacy_prompt, build_structured_prompt  # noqa: E402
+
+DEFAULT_SYMPTOMS = "I have a headache and sore throat for two days."
+
+
+def estimate_tokens(text):
+    return max(1, round(len(text) / 4))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symptoms", default=DEFAULT_SYMPTOMS)
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL_NAME", "gemini-2.5-flash"))
+    args = parser.parse_args()
+
+    legacy = build_legacy_prompt(args.symptoms)
+    structured = build_structured_prompt(args.symptoms)
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if api_key:
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        legacy_tokens = genai.GenerativeModel(args.model).count_tokens(legacy).total_tokens
+        structured_tokens = (
+            genai.GenerativeModel(args.model, system_instruction=SYSTEM_INSTRUCTION)
+            .count_tokens(structured)
+            .total_tokens
+        )
+        method = f"count_tokens ({args.model})"
+    else:
+        legacy_tokens = estimate_tokens(legacy)
+        structured_tokens = estimate_tokens(SYSTEM_INSTRUCTION) + estimate_tokens(structured)
+        method = "estimate (~4 chars/token; set GEMINI_API_KEY for exact counts)"
+
+    legacy_bytes = len(legacy.encode())
+    structured_bytes = len(SYSTEM_INSTRUCTION.encode()) + len(structured.encode())
+
+    print(f"Token counts: {method}")
+    print(f"{'mode':<12}{'bytes':>8}{'tokens':>8}")
+    print(f"{'legacy':<12}{legacy_bytes:>8}{legacy_tokens:>8}")
+    print(f"{'structured':<12}{structured_bytes:>8}{structured_tokens:>8}")
+    saved = legacy_tokens - structured_tokens
+    print(f"Saved per request: {saved} tokens ({saved / legacy_tokens:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Cold-start time of the backend, as seen after a deploy or a scale-up.
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --workers 4 --runs 5
+
+For each run, against a fresh SQLite database and a dummy Gemini key (the
+SDK is configured but never called):
+
+  import    `import main` in a fresh interpreter
+  ready     `serve.py` spawned -> first 200 from /health
+  llm       `serve.py` spawned -> /health reports the LLM client built
+  drain     SIGTERM -> every process exited
+
+and prints the median of each.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+def environment(workdir):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        RESPONSE_CACHE_SQLITE_PATH=os.path.join(workdir, "response_cache.db"),
+        GEMINI_API_KEY="startup-benchmark-not-a-real-key",
+        LLM_BACKEND="gemini",
+        RATE_LIMIT_BACKEND="none",
+    )
+    env.pop("ASYNC_DATABASE_URL", None)
+    return env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def health(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return json.loads(resp.read())
+    except OSError:
+        return None
+
+
+def measure_import(env):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_server(env, workers, timeout):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, start_new_session=True,
+    )
+    ready = llm = None
+    try:
+        while time.perf_counter() - start < timeout:
+            body = health(url)
+            if body is not None:
+                now = time.perf_counter() - start
+                ready = ready or now
+                if body.get("llm_ready"):
+                    llm = now
+                    break
+            time.sleep(0.01)
+    finally:
+        stop = time.perf_counter()
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=timeout)
+        drain = time.perf_counter() - stop
+    if ready is None:
+        raise RuntimeError(f"Server did not answer {url} within {timeout}s")
+    return ready, llm, drain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    results = {"import": [], "ready": [], "llm": [], "drain": []}
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="symptom-startup-") as workdir:
+            env = environment(workdir)
+            results["import"].append(measure_import(env))
+            ready, llm, drain = measure_server(env, args.workers, args.timeout)
+            results["ready"].append(ready)
+            results["drain"].append(drain)
+            if llm is not None:
+                results["llm"].append(llm)
+        print(f"run {run + 1}: import {results['import'][-1]:.2f}s  ready {ready:.2f}s  "
+              f"llm {'-' if llm is None else f'{llm:.2f}s'}  drain {drain:.2f}s")
+
+    print(f"median over {args.runs} runs, {args.workers} workers:")
+    for name, samples in results.items():
+        if samples:
+            print(f"  {name:<8}{statistics.median(samples):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
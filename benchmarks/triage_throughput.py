@@ -0,0 +1,74 @@
+"""Throughput of the local red-flag pre-triage over a synthetic symptom corpus.
+
+    python benchmarks/triage_throughput.py
+    python benchmarks/triage_throughput.py --texts 200000 --words 120 --red-flag-rate 0.02
+
+Compares the Aho-Corasick matcher used by the backend with a naive scan
+that checks every phrase against every text, so the effect of dictionary
+size on each approach is visible.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from triage import EMERGENCY_PHRASES, URGENT_PHRASES, normalize_text, triage  # noqa: E402
+
+FILLER = (
+    "i have had a mild headache and sore throat for two days with some tiredness runny nose and a slight cough "
+    "my back aches after sitting at work and my stomach feels upset in the morning sometimes i feel dizzy when "
+    "standing up quickly and my joints are stiff"
+).split()
+CONNECTORS = [", ", ". ", " and ", " "]
+
+
+def build_corpus(count, words, red_flag_rate, seed):
+    rng = random.Random(seed)
+    phrases = [p for table in (EMERGENCY_PHRASES, URGENT_PHRASES) for variants in table.values() for p in variants]
+    corpus = []
+    for _ in range(count):
+        text = " ".join(rng.choice(FILLER) for _ in range(words))
+        if rng.random() < red_flag_rate:
+            cut = rng.randrange(len(text) + 1)
+            text = text[:cut] + rng.choice(CONNECTORS) + rng.choice(phrases) + rng.choice(CONNECTORS) + text[cut:]
+        corpus.append(text)
+    return corpus
+
+
+def naive_triage(text, phrases):
+    padded = " " + " ".join(normalize_text(text)) + " "
+    return [label for phrase, label in phrases if phrase in padded]
+
+
+def run(name, fn, corpus):
+    start = time.perf_counter()
+    matches = sum(1 for text in corpus if fn(text))
+    elapsed = time.perf_counter() - start
+    megabytes = sum(len(text) for text in corpus) / 1e6
+    print(f"{name:<14}{len(corpus) / elapsed:>12,.0f}{megabytes / elapsed:>10.1f}{elapsed / len(corpus) * 1e6:>10.1f}{matches:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=40, help="Words per symptom description")
+    parser.add_argument("--red-flag-rate", type=float, default=0.05, help="Fraction of texts containing a red flag")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.texts, args.words, args.red_flag_rate, args.seed)
+    phrases = [
+        (" " + " ".join(normalize_text(p)) + " ", label)
+        for table in (EMERGENCY_PHRASES, URGENT_PHRASES) for label, variants in table.items() for p in variants
+    ]
+    print(f"{len(corpus)} texts of {args.words} words, {len(phrases)} phrases")
+    print(f"{'matcher':<14}{'texts/s':>12}{'MB/s':>10}{'us/text':>10}{'matched':>10}")
+    run("aho-corasick", lambda text: triage(text, mode="on").severity, corpus)
+    run("naive scan", lambda text: naive_triage(text, phrases), corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Backend connection settings
+API_URL = os.getenv("API_URL", "http://localhost:9002")
+CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", 15))
+CHECK_READ_TIMEOUT = float(os.getenv("API_CHECK_READ_TIMEOUT", 120))  # LLM-backed calls
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", 10))
+# How long history/stats responses are reused across Streamlit reruns without asking the
+# backend; after that they are revalidated with If-None-Match (a 304 costs no body)
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", 5))
+# Responses kept across all users (least recently used are dropped first); entries of
+# tokens that have expired are dropped too, whether or not their user logged out
+HISTORY_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_CACHE_MAX_ENTRIES", 500))
+
+
+def token_expiry(token):
+    """The `exp` claim of a JWT, read without verification (the backend verifies), or None."""
+    try:
+        payload = token.split(".")[1]
+        return float(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class APIClient:
+    """One pooled HTTP session for the whole Streamlit process.
+
+    Streamlit reruns app.py on every interaction; this module is imported once,
+    so keep-alive connections and the read cache survive those reruns. Cached
+    GETs are keyed by token, so users never see each other's data; the
+    cache is bounded by HISTORY_CACHE_MAX_ENTRIES and the tokens' expiry.
+    """
+
+    def __init__(self, base_url=API_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = OrderedDict()  # (token, path, params) -> (expires_at, response), least recently used first
+        self._token_expiry = {}  # token -> `exp` of the tokens that have cache entries
+        self._lock = threading.Lock()
+
+    def request(self, method, path, token=None, read_timeout=READ_TIMEOUT, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return self.session.request(
+            method, f"{self.base_url}{path}", headers=headers, timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs
+        )
+
+    def get_cached(self, token, path, params=None):
+        """GET with a per-token TTL cache; only successful responses are kept.
+
+        Expired entries are revalidated with their ETag, so an unchanged
+        history costs the backend one lookup and the wire an empty 304.
+        """
+        key = (token, path, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                if entry[0] > now:
+                    return entry[1]
+        headers = {}
+        etag = entry[1].headers.get("ETag") if entry is not None else None
+        if etag:
+            headers["If-None-Match"] = etag
+        resp = self.request("GET", path, token=token, params=params, headers=headers)
+        if resp.status_code == 304 and entry is not None:
+            resp = entry[1]
+        if resp.status_code == 200:
+            with self._lock:
+                self._cache[key] = (now + HISTORY_CACHE_TTL_SECONDS, resp)
+                self._cache.move_to_end(key)
+                if token not in self._token_expiry:
+                    self._token_expiry[token] = token_expiry(token)
+                self._evict()
+        return resp
+
+    def _evict(self):
+        now = time.time()
+        expired = {token for token, exp in self._token_expiry.items() if exp is not None and exp <= now}
+        if expired:
+            for key in [key for key in self._cache if key[0] in expired]:
+                del self._cache[key]
+        while len(self._cache) > HISTORY_CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+        live = {key[0] for key in self._cache}
+        for token in [token for token in self._token_expiry if token not in live]:
+            del self._token_expiry[token]
+
+    def invalidate(self, token):
+        """Drop everything cached for `token` (after a new check or a delete)."""
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == token]:
+                del self._cache[key]
+            self._token_expiry.pop(token, None)
+
+    def login(self, email, password):
+        # OAuth2 expects a 'username' field; the backend accepts the email there
+        return self.request("POST", "/token", data={"username": email, "password": password})
+
+    def register(self, username, email, password):
+        return self.request("POST", "/register/", json={"username": username, "email": email, "password": password})
+
+    def history_page(self, token, limit, before=None, query=None):
+        params = {"limit": limit}
+        if before:
+            params["before"] = before
+        if query:
+            params["q"] = query
+            return self.get_cached(token, "/history/search", params)
+        return self.get_cached(token, "/history/", params)
+
+    def latest(self, token):
+        return self.get_cached(token, "/history/latest")
+
+    def stats(self, token):
+        return self.get_cached(token, "/stats")
+
+    def delete_history(self, token, item_id):
+        resp = self.request("DELETE", f"/history/{item_id}", token=token)
+        self.invalidate(token)
+        return resp
+
+    def stream_check(self, token, symptoms, idempotency_key=None):
+        """Yield (event, data) pairs from the server-sent events of /check_symptoms/stream.
+
+        With an `idempotency_key`, a connection that breaks before `done` is
+        retried once with the same key. The backend keeps running the first
+        request without its client; the retry waits for that run and gets its
+        answer as a single `done` event (or runs again if it failed).
+        """
+        headers = {"Accept": "text/event-stream"}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        attempts = 2 if idempotency_key else 1
+        try:
+            for attempt in range(attempts):
+                try:
+                    yield from self._stream_events(token, symptoms, headers)
+                    return
+                except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                    if attempt + 1 == attempts:
+                        raise
+        finally:
+            # A new entry may have been saved even if the stream broke off
+            self.invalidate(token)
+
+    def _stream_events(self, token, symptoms, headers):
+        with self.request(
+            "POST", "/check_symptoms/stream", token=token, read_timeout=CHECK_READ_TIMEOUT,
+            json={"symptoms": symptoms}, headers=dict(headers), stream=True,
+        ) as resp:
+            if resp.status_code != 200:
+                yield "error", {"detail": resp.text}
+                return
+            event = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event:
+                    yield event, json.loads(line[len("data:"):].strip())
+                    event = None
+
+client = APIClient()
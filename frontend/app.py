@@ -1,9 +1,10 @@
 import streamlit as st
-import requests
 import re
+import uuid
+
+import requests
 
-# Configuration
-API_URL = "http://localhost:9002"
+from api_client import client
 
 st.set_page_config(page_title="AI Symptom Checker", page_icon="🩺", layout="wide")
 
@@ -44,8 +45,7 @@ def login():
                     st.error("Please fill in all fields")
                 else:
                     try:
-                        # OAuth2 expects 'username' field, but we send email
-                        resp = requests.post(f"{API_URL}/token", data={"username": email, "password": password})
+                        resp = client.login(email, password)
                         if resp.status_code == 200:
                             data = resp.json()
                             st.session_state.token = data["access_token"]
@@ -80,7 +80,7 @@ def register():
                         st.error("Invalid email format")
                     else:
                         try:
-                            resp = requests.post(f"{API_URL}/register/", json={"username": username, "email": email, "password": password})
+                            resp = client.register(username, email, password)
                             if resp.status_code == 200:
                                 st.success("Registered successfully! Please login.")
                             else:
@@ -93,12 +93,31 @@ def register():
                         except Exception as e:
                             st.error(f"Connection error: {e}")
 
+HISTORY_PAGE_SIZE = 20
+
+def reset_history():
+    st.session_state.pop("history_items", None)
+    st.session_state.pop("history_cursor", None)
+
+def load_history_page():
+    """Append the next page of history (or of search results) to session state, following the server's cursor."""
+    resp = client.history_page(
+        st.session_state.token,
+        HISTORY_PAGE_SIZE,
+        before=st.session_state.get("history_cursor"),
+        query=st.session_state.get("history_query"),
+    )
+    if resp.status_code != 200:
+        raise Exception("Failed to load history")
+    st.session_state.history_items = st.session_state.get("history_items", []) + resp.json()
+    st.session_state.history_cursor = resp.headers.get("X-Next-Cursor")
+
 def delete_history_item(item_id):
     try:
-        headers = {"Authorization": f"Bearer {st.session_state.token}"}
-        resp = requests.delete(f"{API_URL}/history/{item_id}", headers=headers)
+        resp = client.delete_history(st.session_state.token, item_id)
         if resp.status_code == 200:
             st.success("Deleted successfully")
+            reset_history()
             st.rerun()
         else:
             st.error("Failed to delete")
@@ -173,8 +192,10 @@ def main_app():
         st.title("🩺 AI Health")
         st.write(f"Welcome, **{st.session_state.username}**!")
         if st.button("Logout", use_container_width=True):
+            client.invalidate(st.session_state.token)
             st.session_state.token = None
             st.session_state.username = None
+            reset_history()
             st.rerun()
     
     tab1, tab2, tab3 = st.tabs(["🏠 Dashboard", "🔍 Check Symptoms", "📜 History"])
@@ -192,16 +213,19 @@ def main_app():
         
         with col2:
             st.markdown("#### 📊 Recent Activity")
-            # Fetch latest 1 item for preview
+            # Served from the backend's rollup table, so this stays cheap however long the history is
             try:
-                headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                resp = requests.get(f"{API_URL}/history/", headers=headers)
+                resp = client.stats(st.session_state.token)
                 if resp.status_code == 200:
-                    history = resp.json()
-                    if history:
-                        latest = history[0]
+                    stats = resp.json()
+                    latest = stats["latest"]
+                    if latest:
                         st.write(f"**Last Check:** {latest['created_at']}")
                         st.write(f"**Summary:** {latest['summary']}")
+                        st.write(f"**Total Checks:** {stats['total']}")
+                        for severity, count in sorted(stats["by_severity"].items()):
+                            st.write(f"- {severity}: {count}")
+                        st.bar_chart({week["week"]: week["count"] for week in stats["by_week"]})
                     else:
                         st.write("No recent activity.")
             except:
@@ -210,6 +234,14 @@ def main_app():
     # --- CHECK SYMPTOMS ---
     with tab2:
         st.header("Check Symptoms")
+        # The previous check, for comparison; /history/latest is a single index seek
+        try:
+            resp = client.latest(st.session_state.token)
+            last = resp.json() if resp.status_code == 200 else None
+            if last:
+                st.caption(f"Last check ({last['created_at']}, {last['severity_estimate']}): {last['summary']}")
+        except (requests.RequestException, ValueError) as e:
+            st.caption(f"Could not load your last check: {e}")
         symptoms = st.text_area("Describe your symptoms:", height=150, placeholder="e.g., I have a headache and sore throat for two days.")
         
         if st.button("Analyze Symptoms", type="primary"):
@@ -217,70 +249,101 @@ def main_app():
                 st.warning("Please enter symptoms.")
                 return
             
-            with st.spinner("Analyzing..."):
-                try:
-                    headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                    resp = requests.post(f"{API_URL}/check_symptoms/", json={"symptoms": symptoms}, headers=headers)
-                    
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        
-                        # Display Results
-                        st.success("Analysis Complete")
-                        
+            status = st.empty()
+            status.info("Analyzing...")
+
+            # Placeholders in display order; each one is filled as its section streams in
+            summary_box = st.empty()
+            severity_box = st.empty()
+            c1, c2 = st.columns(2)
+            with c1:
+                causes_box = st.empty()
+            with c2:
+                tips_box = st.empty()
+            flags_box = st.empty()
+            timing_box = st.empty()
+            disclaimer_box = st.empty()
+
+            def show_section(key, value):
+                if key == "summary":
+                    with summary_box.container():
                         st.subheader("📝 Summary")
-                        st.write(data["summary"])
-                        
+                        st.write(value)
+                elif key == "severity_estimate":
+                    with severity_box.container():
                         st.subheader("🎯 Severity Estimate")
-                        severity = data["severity_estimate"]
-                        if "High" in severity:
-                            st.error(f"**{severity}**")
-                        elif "Moderate" in severity:
-                            st.warning(f"**{severity}**")
+                        if "High" in value:
+                            st.error(f"**{value}**")
+                        elif "Moderate" in value:
+                            st.warning(f"**{value}**")
                         else:
-                            st.success(f"**{severity}**")
-                            
-                        c1, c2 = st.columns(2)
-                        with c1:
-                            st.subheader("🔍 Possible Causes")
-                            for cause in data["possible_common_causes"]:
-                                st.write(f"- {cause}")
-                        with c2:
-                            st.subheader("💡 Self-Care Tips")
-                            for tip in data["self_care_tips"]:
-                                st.write(f"- {tip}")
-                            
+                            st.success(f"**{value}**")
+                elif key == "possible_common_causes":
+                    with causes_box.container():
+                        st.subheader("🔍 Possible Causes")
+                        for cause in value:
+                            st.write(f"- {cause}")
+                elif key == "self_care_tips":
+                    with tips_box.container():
+                        st.subheader("💡 Self-Care Tips")
+                        for tip in value:
+                            st.write(f"- {tip}")
+                elif key == "red_flags":
+                    with flags_box.container():
                         st.subheader("🚩 Red Flags")
-                        for flag in data["red_flags"]:
+                        for flag in value:
                             st.error(f"- {flag}")
-                            
-                        st.info(f"📅 **Consultation:** {data['consultation_timing']}")
-                        
+                elif key == "consultation_timing":
+                    timing_box.info(f"📅 **Consultation:** {value}")
+                elif key == "disclaimer":
+                    with disclaimer_box.container():
                         st.divider()
-                        st.caption(f"⚠️ **Disclaimer**: {data['disclaimer']}")
-                        
-                    else:
-                        st.error(f"Error: {resp.text}")
-                except Exception as e:
-                    st.error(f"Error: {e}")
+                        st.caption(f"⚠️ **Disclaimer**: {value}")
+
+            # One key per check, reused if the same symptoms are submitted again before a
+            # result came back: the backend then replays its answer instead of re-running it
+            if st.session_state.get("check_symptoms") != symptoms:
+                st.session_state.check_symptoms = symptoms
+                st.session_state.check_key = str(uuid.uuid4())
+
+            try:
+                for event, data in client.stream_check(st.session_state.token, symptoms, st.session_state.check_key):
+                    if event == "error":
+                        status.error(f"Error: {data.get('detail', data)}")
+                        break
+                    if event == "done":
+                        # A replayed answer arrives as `done` alone, so (re)draw every section from it
+                        for key, value in data.items():
+                            show_section(key, value)
+                        status.success("Analysis Complete")
+                        st.session_state.pop("check_symptoms", None)
+                        reset_history()
+                        break
+                    show_section(data["key"], data["value"])
+            except Exception as e:
+                status.error(f"Error: {e}")
 
     # --- HISTORY ---
     with tab3:
         st.header("📜 Consultation History")
         if st.button("Refresh History"):
-            st.rerun()
-            
+            reset_history()
+        query = st.text_input("Search your history", placeholder="e.g. migraine").strip()
+        if query != st.session_state.get("history_query", ""):
+            reset_history()
+            st.session_state.history_query = query
+
         try:
-            headers = {"Authorization": f"Bearer {st.session_state.token}"}
-            resp = requests.get(f"{API_URL}/history/", headers=headers)
-            if resp.status_code == 200:
-                history = resp.json()
-                if not history:
-                    st.info("No history found.")
-                for h in history:
-                    render_history_card(h)
-            else:
-                st.error("Failed to load history")
+            if "history_items" not in st.session_state:
+                load_history_page()
+            if not st.session_state.history_items:
+                st.info("No matching entries." if query else "No history found.")
+            for h in st.session_state.history_items:
+                render_history_card(h)
+            if st.session_state.history_cursor:
+                if st.button("Load more"):
+                    load_history_page()
+                    st.rerun()
         except Exception as e:
             st.error(f"Error loading history: {e}")
 